@@ -0,0 +1,387 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import submission_backup
+import submission_manifest
+import submission_memory
+import submission_metrics
+import submission_roster
+from rename_politemall_student_sub import (backup_zip_files_to_parent, process_submission_directory,
+                                           read_name_list, rename_directory, stream_submission_directory,
+                                           unzip_all_zip_files, write_submission_report)
+
+# Benchmark for the rename_politemall_student_sub.py pipeline.
+#
+# Generates a synthetic cohort shaped like an LMS download: one folder per
+# submission named "<lms id>-<n> - <NAME> SOI 2024", each holding a ZIP with many
+# small files and ZIPs nested inside it, plus loose files. Some students
+# resubmit (so their folders are merged), some folder names are malformed
+# (odd case and spacing, swapped or misspelt names) and a few archives are corrupt.
+# Each pipeline stage is then timed on it:
+#
+#   python bench_pipeline.py --roster class001.csv --students 500 --repeat 3
+#
+# Results are printed as files/s and MB/s per stage, and can be saved as JSON
+# (--json) to compare against a later run. With --stream, backup, unzip and
+# rename/merge run as one overlapped 'stream' stage.
+#
+# --memory-check MB checks the low-memory mode instead of timing: the pipeline
+# runs on cohorts of --students, twice and four times as many students, once
+# with that memory budget and once without, each in a fresh process. The check
+# fails (exit status 1) if the low-memory peak RSS grows by more than
+# --rss-tolerance-mb between the smallest and largest cohort. The normal mode's
+# growth is shown next to it; a cohort on which it stays within the tolerance
+# too is reported as too small to tell the modes apart:
+#
+#   python bench_pipeline.py --students 200 --memory-check 512
+
+# Fixed ZIP timestamp, so generated cohorts are identical for the same seed
+ZIP_DATE = (2024, 3, 1, 12, 0, 0)
+
+
+# Returns N (student_id, name, class, team) rows. Names come from the rosters;
+# beyond their size, new names are made by mixing their name tokens.
+def build_roster(roster_paths, students, rng):
+    rows = []
+    for roster_path in roster_paths:
+        with open(roster_path, newline='', encoding='utf-8') as csvfile:
+            rows.extend((row['student_id'], row['name'], row['class'], row['team'])
+                        for row in csv.DictReader(csvfile))
+    if not rows:
+        raise ValueError("The rosters have no students")
+    tokens = sorted({token for row in rows for token in row[1].split()})
+    names = {row[1] for row in rows}
+    next_id = max(int(row[0]) for row in rows) + 1
+    while len(rows) < students:
+        name = ' '.join(rng.sample(tokens, rng.randint(2, 4)))
+        if name in names:
+            continue
+        names.add(name)
+        rows.append((str(next_id), name, 'C353-BENCH', f"Team{rng.randint(1, 8)}"))
+        next_id += 1
+    return rows[:students]
+
+
+def write_roster(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['student_id', 'name', 'class', 'team'])
+        writer.writerows(rows)
+
+
+# The name as it appears in the LMS folder; a share of them is malformed
+def folder_display_name(name, rng, malformed_ratio):
+    if rng.random() >= malformed_ratio:
+        return name
+    tokens = name.split()
+    kind = rng.randrange(4)
+    if kind == 0:
+        return '  '.join(tokens).lower()            # Case and spacing
+    if kind == 1 and len(tokens) > 1:
+        return ', '.join([tokens[-1]] + tokens[:-1])  # Surname first, with a comma
+    if kind == 2:
+        i = rng.randrange(len(name))
+        return name[:i] + name[i + 1:]              # One letter dropped
+    return name + ' (RESUBMIT)'
+
+
+def file_content(rng, size):
+    # Half random bytes, half repetitive text, so the archives compress like source code would
+    random_part = rng.randbytes(size // 2)
+    return random_part + b'print("hello world")\n' * ((size - len(random_part)) // 21 + 1)
+
+
+# Builds one archive in memory: files_per_zip files and, below depth 0,
+# another archive of the same shape. Nested archives get distinct names, as an
+# archive holding one with its own name would be overwritten while extracting.
+def build_zip(rng, depth, files_per_zip, file_size, label=''):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(files_per_zip):
+            folder = ('src/', 'src/lib/', 'docs/', '')[i % 4]
+            zip_ref.writestr(zipfile.ZipInfo(f"{folder}file{label}{i}.py", ZIP_DATE),
+                             file_content(rng, rng.randint(file_size // 2, file_size * 3 // 2)))
+        if depth > 0:
+            zip_ref.writestr(zipfile.ZipInfo(f"inner{label}.zip", ZIP_DATE),
+                             build_zip(rng, depth - 1, files_per_zip, file_size, label + 'n'))
+    return buffer.getvalue()
+
+
+# Writes a synthetic cohort into submissions_dir and its roster to roster_path.
+# Returns the number of submission folders created.
+def generate_cohort(submissions_dir, roster_path, roster_rows, resubmit_ratio=0.3, nesting_depth=2,
+                    files_per_zip=20, file_size=2048, malformed_ratio=0.1, corrupt_ratio=0.02, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(submissions_dir, exist_ok=True)
+    write_roster(roster_path, roster_rows)
+    folders = 0
+    for number, (student_id, name, class_, team) in enumerate(roster_rows):
+        attempts = 2 if rng.random() < resubmit_ratio else 1
+        for attempt in range(attempts):
+            lms_id = 100000 + folders
+            folder = os.path.join(submissions_dir,
+                                  f"{lms_id}-{number} - {folder_display_name(name, rng, malformed_ratio)} SOI 2024")
+            os.makedirs(folder)
+            archive = os.path.join(folder, 'submission.zip')
+            if rng.random() < corrupt_ratio:
+                with open(archive, 'wb') as f:
+                    f.write(rng.randbytes(file_size))
+            else:
+                with open(archive, 'wb') as f:
+                    f.write(build_zip(rng, nesting_depth, files_per_zip, file_size))
+            with open(os.path.join(folder, 'README.txt'), 'w', encoding='utf-8') as f:
+                f.write(f"Submission {attempt + 1} by {name}\n")
+            folders += 1
+    return folders
+
+
+# Counts the regular files and bytes under a directory, and how many are ZIPs
+def measure_tree(directory):
+    files = size = zips = zip_bytes = 0
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    entry_size = entry.stat(follow_symlinks=False).st_size
+                    files += 1
+                    size += entry_size
+                    if entry.name.endswith('.zip'):
+                        zips += 1
+                        zip_bytes += entry_size
+    return files, size, zips, zip_bytes
+
+
+# Runs the pipeline stages on one generated tree, as process_submission_directory
+# does, and returns {stage: {'seconds', 'files', 'bytes'}}. Backup throughput is
+# counted over the ZIPs it copies; the other stages over the tree they leave.
+def run_pipeline(target_directory, roster_path, strategy='auto', workers=1):
+    name_dict = read_name_list(roster_path)
+    roster_index = submission_roster.RosterIndex.from_name_dict(name_dict)
+    manifest = submission_manifest.SubmissionManifest(target_directory)
+    log_path = os.path.join(target_directory, 'merge_log.txt')
+    stages = (
+        ('backup', lambda: backup_zip_files_to_parent(target_directory, strategy, manifest)),
+        ('unzip', lambda: unzip_all_zip_files(target_directory, workers, manifest)),
+        ('rename', lambda: rename_directory(target_directory, name_dict, log_path, manifest, roster_index)),
+        ('report', lambda: write_submission_report(target_directory, manifest=manifest)),
+    )
+    return time_stages(target_directory, stages)
+
+
+# Same as run_pipeline, with backup, unzip and rename/merge streamed per student
+def run_stream_pipeline(target_directory, roster_path, strategy='auto', workers=1):
+    name_dict = read_name_list(roster_path)
+    roster_index = submission_roster.RosterIndex.from_name_dict(name_dict)
+    manifest = submission_manifest.SubmissionManifest(target_directory)
+    log_path = os.path.join(target_directory, 'merge_log.txt')
+    listings = {}
+    stages = (
+        ('stream', lambda: listings.update(asyncio.run(stream_submission_directory(
+            target_directory, name_dict, log_path, manifest, roster_index, strategy, workers)))),
+        ('report', lambda: write_submission_report(target_directory, manifest=manifest, listings=listings)),
+    )
+    return time_stages(target_directory, stages)
+
+
+# Times (stage, callable) pairs in order, returning {stage: {'seconds', 'files', 'bytes'}}
+def time_stages(target_directory, stages):
+    results = {}
+    for stage, run in stages:
+        before = measure_tree(target_directory)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+        if stage in ('backup', 'stream'):
+            files, size = before[2], before[3]
+        else:
+            files, size = measure_tree(target_directory)[:2]
+        results[stage] = {'seconds': seconds, 'files': files, 'bytes': size}
+    return results
+
+
+# Runs the whole pipeline once, quietly, in low-memory mode with a budget of
+# budget_mb or in the normal mode if it is None, and returns the peak RSS in
+# bytes (None if it cannot be measured) and whether the budget was exceeded.
+# Meant to run in a fresh process so the peak is its own; where the peak can be
+# reset, it is from the start of the run, not of the process.
+def measure_peak_rss(target_directory, roster_path, budget_mb=None, strategy='auto', workers=1, streaming=False):
+    gc.collect()
+    submission_memory.reset_peak_rss()
+    memory_budget = submission_memory.MemoryBudget.from_mb(budget_mb) if budget_mb is not None else None
+    name_dict = read_name_list(roster_path)
+    metrics = submission_metrics.RunMetrics(quiet=True, progress_interval=None, memory_budget=memory_budget)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        process_submission_directory(target_directory, name_dict, strategy=strategy, workers=workers,
+                                     metrics=metrics, streaming=streaming, memory_budget=memory_budget)
+    if memory_budget is None:
+        return submission_memory.peak_rss(), False
+    memory = metrics.summary()['memory']
+    return memory['peak_rss_bytes'], memory['over_budget']
+
+
+MEASURE_SCRIPT = ("import json, sys, bench_pipeline; "
+                  "print(json.dumps(bench_pipeline.measure_peak_rss(*json.loads(sys.argv[1]))))")
+
+
+# measure_peak_rss in a fresh interpreter; returns its result. Not a
+# multiprocessing child, which imports the caller's main module (a test runner,
+# say) first: memory that module frees is reused by the run and hides its growth.
+def measure_peak_rss_isolated(target_directory, roster_path, budget_mb=None, strategy='auto', workers=1,
+                              streaming=False):
+    args = json.dumps([target_directory, roster_path, budget_mb, strategy, workers, streaming])
+    result = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT, args], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    peak, over_budget = json.loads(result.stdout.splitlines()[-1])
+    return peak, over_budget
+
+
+# Generates cohorts of 1x, 2x and 4x the students and measures the peak RSS of
+# a low-memory run and a normal run on each. Returns 0 if the low-memory peak
+# stays within tolerance_mb and the budget, else 1.
+def check_memory(args, roster_paths, work_dir):
+    mb = submission_memory.MB
+    modes = (('low', args.memory_check), ('normal', None))
+    peaks = {mode: [] for mode, _ in modes}
+    print(f"\n{'students':>8} {'folders':>8} {'files':>8} {'tree MB':>8} {'low MB':>8} {'normal MB':>10}")
+    for scale in (1, 2, 4):
+        roster_rows = build_roster(roster_paths, args.students * scale, random.Random(args.seed))
+        run_dir = os.path.join(work_dir, f"memory{scale}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        cohort_dir = os.path.join(run_dir, 'cohort')
+        roster_path = os.path.join(run_dir, 'roster.csv')
+        folders = generate_cohort(cohort_dir, roster_path, roster_rows, args.resubmit_ratio,
+                                  args.nesting_depth, args.files_per_zip, args.file_size, args.malformed_ratio,
+                                  args.corrupt_ratio, args.seed)
+        files, size = measure_tree(cohort_dir)[:2]
+        over_budget = False
+        for mode, budget_mb in modes:
+            # Each mode gets its own copy, in its own folder so the backups do not mix
+            target_directory = os.path.join(run_dir, mode, 'submissions')
+            shutil.copytree(cohort_dir, target_directory)
+            peak, over = measure_peak_rss_isolated(target_directory, roster_path, budget_mb, args.backup_strategy,
+                                                   args.workers, args.stream)
+            if peak is None:
+                print("Peak memory cannot be measured on this platform")
+                return 1
+            peaks[mode].append(peak)
+            over_budget = over_budget or over
+        print(f"{len(roster_rows):>8} {folders:>8} {files:>8} {size / mb:>8.1f} {peaks['low'][-1] / mb:>8.1f} "
+              f"{peaks['normal'][-1] / mb:>10.1f}{'  over budget' if over_budget else ''}")
+        if not args.keep:
+            shutil.rmtree(run_dir)
+
+    growth = {mode: (values[-1] - values[0]) / mb for mode, values in peaks.items()}
+    flat = growth['low'] <= args.rss_tolerance_mb and max(peaks['low']) <= args.memory_check * mb
+    print(f"\nPeak RSS grew {growth['low']:.1f} MB in low-memory mode and {growth['normal']:.1f} MB in normal "
+          f"mode from {args.students} to {args.students * 4} students "
+          f"(tolerance {args.rss_tolerance_mb:g} MB): {'OK' if flat else 'FAILED'}")
+    if growth['normal'] <= args.rss_tolerance_mb:
+        print("The normal mode stayed within the tolerance too: use more --students or --files-per-zip "
+              "to tell the modes apart")
+    return 0 if flat else 1
+
+
+def print_results(runs):
+    print(f"\n{'stage':<8} {'best s':>9} {'median s':>9} {'files':>8} {'files/s':>10} {'MB/s':>8}")
+    for stage in runs[0]:
+        timings = sorted(run[stage]['seconds'] for run in runs)
+        best = timings[0]
+        files, size = runs[0][stage]['files'], runs[0][stage]['bytes']
+        print(f"{stage:<8} {best:>9.3f} {timings[len(timings) // 2]:>9.3f} {files:>8} "
+              f"{files / best if best else 0:>10.0f} {size / best / 1e6 if best else 0:>8.1f}")
+    total = min(sum(stage['seconds'] for stage in run.values()) for run in runs)
+    print(f"{'total':<8} {total:>9.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the submission pipeline on a synthetic cohort.")
+    parser.add_argument('--roster', action='append', default=[],
+                        help="roster CSV to take names from (repeatable, default class001.csv)")
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--resubmit-ratio', type=float, default=0.3,
+                        help="share of students with a second submission folder to merge")
+    parser.add_argument('--nesting-depth', type=int, default=2, help="levels of ZIPs inside each submission ZIP")
+    parser.add_argument('--files-per-zip', type=int, default=20)
+    parser.add_argument('--file-size', type=int, default=2048, help="average file size in bytes")
+    parser.add_argument('--malformed-ratio', type=float, default=0.1)
+    parser.add_argument('--corrupt-ratio', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="runs on fresh copies of the cohort")
+    parser.add_argument('--workers', type=int, default=1, help="parallel unzip workers")
+    parser.add_argument('--stream', action='store_true', help="time the streamed pipeline instead")
+    parser.add_argument('--backup-strategy', default='auto', choices=submission_backup.BACKUP_STRATEGIES)
+    parser.add_argument('--work-dir', help="where to generate the cohort (default: a temporary directory)")
+    parser.add_argument('--keep', action='store_true', help="keep the generated trees")
+    parser.add_argument('--json', help="also save the results to this JSON file")
+    parser.add_argument('--memory-check', type=int, metavar='MB',
+                        help="check that peak memory of the low-memory mode, with this budget, stays flat "
+                             "as the cohort grows")
+    parser.add_argument('--rss-tolerance-mb', type=float, default=3,
+                        help="with --memory-check, how much the peak may grow from 1x to 4x the students")
+    args = parser.parse_args(argv)
+
+    roster_paths = args.roster or [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class001.csv')]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_pipeline_')
+    if args.memory_check:
+        status = check_memory(args, roster_paths, work_dir)
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir)
+        return status
+
+    rng = random.Random(args.seed)
+    roster_rows = build_roster(roster_paths, args.students, rng)
+    cohort_dir = os.path.join(work_dir, 'cohort')
+    roster_path = os.path.join(work_dir, 'roster.csv')
+    shutil.rmtree(cohort_dir, ignore_errors=True)
+
+    start = time.perf_counter()
+    folders = generate_cohort(cohort_dir, roster_path, roster_rows, args.resubmit_ratio, args.nesting_depth,
+                              args.files_per_zip, args.file_size, args.malformed_ratio, args.corrupt_ratio,
+                              args.seed)
+    files, size, zips, _ = measure_tree(cohort_dir)
+    print(f"Generated {folders} submission folders for {len(roster_rows)} students "
+          f"({zips} ZIPs, {size / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+    runs = []
+    for i in range(args.repeat):
+        # Each run works on a fresh copy inside its own parent, so backups start empty
+        run_dir = os.path.join(work_dir, f"run{i}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        target_directory = os.path.join(run_dir, 'submissions')
+        shutil.copytree(cohort_dir, target_directory)
+        run = run_stream_pipeline if args.stream else run_pipeline
+        runs.append(run(target_directory, roster_path, args.backup_strategy, args.workers))
+        if not args.keep:
+            shutil.rmtree(run_dir)
+    print_results(runs)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'folders': folders, 'runs': runs}, f, indent=2)
+        print(f"\n📄 Results saved to: {args.json}")
+    if args.keep:
+        print(f"Trees kept in: {work_dir}")
+    elif not args.work_dir:
+        shutil.rmtree(work_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import argparse
+import csv
+import io
+import os
+import shutil
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import submission_backup
+import submission_guard
+import submission_manifest
+import submission_memory
+import submission_metrics
+import submission_plan
+import submission_report
+import submission_roster
+from rename_politemall_student_sub import process_submission_directory, read_name_list
+
+# Non-interactive batch mode: runs the rename_politemall_student_sub.py pipeline
+# over many (roster CSV, submission directory) pairs in one invocation.
+#
+#   python rename_batch_student_sub.py --job class001.csv=/data/C353-001 \
+#                                      --job class005.csv=/data/C353-005 --workers 4
+#
+# or with a CSV of jobs that has `roster` and `directory` columns:
+#
+#   python rename_batch_student_sub.py --jobs-file intake.csv
+#
+# All rosters are loaded once. Each directory is resolved against its own
+# roster first and then against the others, so a student filed under the wrong
+# class directory is still matched. Names that more than one roster gives to
+# different students are listed in the log; each directory prefers its own roster.
+# Directories are processed concurrently; each one's console output is
+# captured and written, in job order, to one consolidated log.
+#
+# --dry-run only logs what would change; --transactional applies unzip and
+# rename/merge as a journaled run, which a later run resumes or --rollback undoes.
+#
+# Each directory gets a pipeline_metrics.json with its stage timings and slowest
+# archives. --quiet leaves the per-item messages out of the log, and --profile
+# also saves cProfile stats for each directory as pipeline_profile.prof.
+#
+# --stream moves each student folder through backup, unzip and rename/merge as
+# soon as it is ready instead of running the stages one after the other.
+#
+# The --max-* options tighten or loosen the extraction limits (see
+# submission_guard); archives over them are quarantined, not extracted.
+#
+# --memory-budget-mb runs each directory in low-memory mode (see
+# submission_memory) with that peak-memory budget per worker process, so
+# --workers times the budget must fit in the machine's RAM. Each directory's
+# output is then spooled to a file next to the log instead of held in memory.
+#
+# --unzip-processes runs each directory's --unzip-workers as processes rather
+# than threads, so deflate is not held to one core by the GIL.
+PROFILE_NAME = 'pipeline_profile.prof'
+
+
+# Reads the roster -> directory pairs from --job arguments and an optional jobs CSV
+def read_jobs(job_args, jobs_file=None):
+    jobs = []
+    for job in job_args or []:
+        roster, sep, directory = job.partition('=')
+        if not sep:
+            raise ValueError(f"Job '{job}' must be given as ROSTER=DIRECTORY")
+        jobs.append((roster.strip(), directory.strip()))
+    if jobs_file:
+        with open(jobs_file, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                jobs.append((row['roster'].strip(), row['directory'].strip()))
+    return jobs
+
+
+# Loads every distinct roster once. Returns ({roster path: name dictionary}, collisions),
+# collisions mapping each name that rosters give to different students to
+# its [(roster path, student_id), ...]
+def load_rosters(roster_paths):
+    rosters = {roster_path: read_name_list(roster_path) for roster_path in dict.fromkeys(roster_paths)}
+    owners = {}
+    for roster_path, name_dict in rosters.items():
+        for name, (student_id, class_, team) in name_dict.items():
+            owners.setdefault(name, []).append((roster_path, student_id))
+    collisions = {name: found for name, found in owners.items() if len({student_id for _, student_id in found}) > 1}
+    return rosters, collisions
+
+
+# The name dictionary and index one job resolves its folders with: its own
+# roster first, then the other rosters. Fuzzy name matches are only applied
+# at or above fuzzy_auto_confidence (none by default; see RosterIndex.applies).
+def job_roster(rosters, roster_path, fuzzy_auto_confidence=None):
+    name_dicts = [rosters[roster_path]] + [name_dict for path, name_dict in rosters.items() if path != roster_path]
+    merged = {}
+    for name_dict in name_dicts:
+        for name, record in name_dict.items():
+            merged.setdefault(name, record)
+    return merged, submission_roster.RosterIndex.from_name_dicts(name_dicts,
+                                                                 auto_confidence=fuzzy_auto_confidence)
+
+
+# Runs the pipeline on one directory inside a worker process.
+# Returns (directory, captured output, error text or None). With output_path
+# the output is written there as it is produced and None is returned for it.
+def run_job(target_directory, rosters, roster_path, strategy, unzip_workers, report_format, deadline,
+            dedupe, hardlink_duplicates, transactional=False, dry_run=False, rollback=False, quiet=False,
+            profile=False, limits=None, streaming=False, memory_budget_mb=None, output_path=None,
+            fuzzy_auto_confidence=None, unzip_processes=False):
+    output = io.StringIO() if output_path is None else open(output_path, 'w', encoding='utf-8')
+    error = None
+    with output, redirect_stdout(output):
+        try:
+            if rollback:
+                submission_plan.rollback_run(target_directory,
+                                             submission_manifest.SubmissionManifest(target_directory))
+            else:
+                name_dict, roster_index = job_roster(rosters, roster_path, fuzzy_auto_confidence)
+                # Measured from inside the worker, so the budget covers this process
+                memory_budget = (submission_memory.MemoryBudget.from_mb(memory_budget_mb)
+                                 if memory_budget_mb else None)
+                # Several jobs share the terminal, so no progress display here
+                metrics = submission_metrics.RunMetrics(quiet=quiet, progress_interval=None,
+                                                        memory_budget=memory_budget)
+                profile_path = os.path.join(target_directory, PROFILE_NAME) if profile else None
+                with submission_metrics.profiled(profile_path):
+                    log_file_path = process_submission_directory(
+                        target_directory, name_dict, roster_index, strategy=strategy, workers=unzip_workers,
+                        report_format=report_format, deadline=deadline, dedupe=dedupe,
+                        hardlink_duplicates=hardlink_duplicates, transactional=transactional, dry_run=dry_run,
+                        metrics=metrics, limits=limits, streaming=streaming, memory_budget=memory_budget,
+                        use_processes=unzip_processes)
+                if log_file_path:
+                    metrics.print_summary()
+                    print(f"✅ Merge log saved to: {log_file_path}")
+        except Exception:
+            error = traceback.format_exc()
+        captured = output.getvalue() if output_path is None else None
+    return target_directory, captured, error
+
+
+def run_batch(jobs, workers=1, strategy='auto', unzip_workers=1, log_path='batch_log.txt',
+              report_format='text', deadline=None, dedupe=False, hardlink_duplicates=False,
+              transactional=False, dry_run=False, rollback=False, quiet=False, profile=False, limits=None,
+              streaming=False, memory_budget_mb=None, fuzzy_auto_confidence=None, unzip_processes=False):
+    missing = [path for roster, directory in jobs for path in (roster, directory) if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing rosters or directories: {', '.join(missing)}")
+
+    rosters, collisions = load_rosters([roster for roster, _ in jobs])
+    students = len({record[0] for name_dict in rosters.values() for record in name_dict.values()})
+    directories = [directory for _, directory in jobs]
+    failures = 0
+
+    with open(log_path, 'w', encoding='utf-8') as log_file, \
+            ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        log_file.write(f"Batch started {datetime.now():%Y-%m-%d %H:%M:%S} "
+                       f"({len(jobs)} directories, {students} students)\n")
+        for name, found in sorted(collisions.items()):
+            owners = ', '.join(f"{roster_path} ({student_id})" for roster_path, student_id in found)
+            log_file.write(f"NAME COLLISION: '{name}' is in {owners}; each directory prefers its own roster\n")
+            print(f"⚠️ '{name}' names different students in {owners}")
+        # In low-memory mode each job's output goes to its own spool file
+        output_paths = [f"{log_path}.{number}.part" if memory_budget_mb else None
+                        for number in range(len(directories))]
+        futures = [executor.submit(run_job, directory, rosters, roster_path, strategy, unzip_workers,
+                                   report_format, deadline, dedupe, hardlink_duplicates,
+                                   transactional, dry_run, rollback, quiet, profile, limits, streaming,
+                                   memory_budget_mb, output_path, fuzzy_auto_confidence, unzip_processes)
+                   for (roster_path, directory), output_path in zip(jobs, output_paths)]
+        for future, output_path in zip(futures, output_paths):
+            directory, output, error = future.result()
+            log_file.write(f"\n===== {directory} =====\n")
+            if output_path is None:
+                log_file.write(output)
+            else:
+                with open(output_path, encoding='utf-8') as spool:
+                    shutil.copyfileobj(spool, log_file)
+                os.remove(output_path)
+            if error:
+                failures += 1
+                log_file.write(f"FAILED:\n{error}")
+                print(f"❌ {directory} failed, see {log_path}")
+            else:
+                print(f"✅ {directory} done")
+            log_file.flush()
+        log_file.write(f"\nBatch finished {datetime.now():%Y-%m-%d %H:%M:%S} ({failures} failed)\n")
+
+    print(f"\n📄 Batch log saved to: {log_path}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process many class submission directories in one run.")
+    parser.add_argument('--job', action='append', metavar='ROSTER=DIRECTORY',
+                        help="roster CSV and the submission directory it applies to (repeatable)")
+    parser.add_argument('--jobs-file', help="CSV with 'roster' and 'directory' columns")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of directories processed at once")
+    parser.add_argument('--unzip-workers', type=int, default=1,
+                        help="parallel unzip workers within each directory")
+    parser.add_argument('--unzip-processes', action='store_true',
+                        help="run the unzip workers as processes instead of threads")
+    parser.add_argument('--backup-strategy', default='auto', choices=submission_backup.BACKUP_STRATEGIES)
+    parser.add_argument('--log', default='batch_log.txt', help="consolidated log file")
+    parser.add_argument('--report-format', default='text', choices=submission_report.REPORT_FORMATS)
+    parser.add_argument('--deadline', type=datetime.fromisoformat,
+                        help="flag files modified after this time as late, e.g. 2024-03-01T23:59")
+    parser.add_argument('--dedupe', action='store_true',
+                        help="remove byte-identical copies within each student folder")
+    parser.add_argument('--hardlink-duplicates', action='store_true',
+                        help="with --dedupe, hardlink identical files across students")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--dry-run', action='store_true',
+                      help="log the planned unzip and rename/merge operations without changing anything")
+    mode.add_argument('--transactional', action='store_true',
+                      help="apply unzip and rename/merge as a journaled run that can be resumed or rolled back")
+    mode.add_argument('--rollback', action='store_true',
+                      help="undo the interrupted transactional run in each directory")
+    parser.add_argument('--quiet', action='store_true',
+                        help="only log failures and stage summaries, not a line per archive or folder")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"run each directory under cProfile and save the stats as {PROFILE_NAME}")
+    parser.add_argument('--stream', action='store_true',
+                        help="overlap backup, unzip and rename/merge across student folders")
+    defaults = submission_guard.ExtractionLimits()
+    parser.add_argument('--max-archive-mb', type=int, default=defaults.max_archive_bytes // submission_guard.MB,
+                        help="largest uncompressed size of one archive")
+    parser.add_argument('--max-student-mb', type=int, default=defaults.max_student_bytes // submission_guard.MB,
+                        help="largest uncompressed size of everything extracted for one student")
+    parser.add_argument('--max-members', type=int, default=defaults.max_archive_members,
+                        help="most files and folders in one archive")
+    parser.add_argument('--max-student-members', type=int, default=defaults.max_student_members)
+    parser.add_argument('--max-ratio', type=int, default=defaults.max_ratio,
+                        help="highest compression ratio of a member of 1 MB or more")
+    parser.add_argument('--max-depth', type=int, default=defaults.max_depth,
+                        help="most levels of ZIPs inside a submitted ZIP")
+    parser.add_argument('--memory-budget-mb', type=int,
+                        help="run in low-memory mode with this peak-memory budget per worker process")
+    parser.add_argument('--fuzzy-auto-confidence', type=float, metavar='RATIO',
+                        help="rename folders by fuzzy name matches scoring at least this (e.g. 0.97); by default "
+                             "they are only logged as suggestions. They are never merged into another folder")
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args.job, args.jobs_file)
+    if not jobs:
+        parser.error("no jobs given; use --job or --jobs-file")
+    limits = submission_guard.ExtractionLimits(
+        max_archive_bytes=args.max_archive_mb * submission_guard.MB, max_archive_members=args.max_members,
+        max_student_bytes=args.max_student_mb * submission_guard.MB, max_student_members=args.max_student_members,
+        max_ratio=args.max_ratio, max_depth=args.max_depth)
+    failures = run_batch(jobs, args.workers, args.backup_strategy, args.unzip_workers, args.log,
+                         args.report_format, args.deadline, args.dedupe, args.hardlink_duplicates,
+                         args.transactional, args.dry_run, args.rollback, args.quiet, args.profile, limits,
+                         args.stream, args.memory_budget_mb, args.fuzzy_auto_confidence, args.unzip_processes)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+import submission_roster
+import submission_unzip
+from submission_guard import ExtractionGuard, LimitExceeded
+from rename_politemall_student_sub import read_name_list, resolve_folders, write_submission_report
+
+# Works straight from the LMS bulk-download ZIP instead of an exploded copy of it.
+#
+# Each member path starts with the student's LMS folder ("<id> - <name> SOI..."),
+# which is resolved to its final "<team>_<name>_<student_id>" folder up front,
+# so every file (including the contents of inner ZIPs) is written once, to its
+# final place. There is no separate extract, backup or rename pass: the bulk
+# download itself stays untouched as the backup.
+#
+# Inner ZIPs are checked against the extraction limits (see submission_guard)
+# before anything in them is written, the submitted ZIPs counting as depth 0;
+# one over a limit is written out as is and quarantined to ../__quarantine.
+
+# Inner ZIPs up to this size are opened in memory; larger ones are spooled to a temp file
+IN_MEMORY_ZIP_LIMIT = 64 * 1024 * 1024
+
+
+class BulkExtractor:
+    def __init__(self, target_directory, name_dict, roster_index, log_file, guard=None):
+        self.target_directory = target_directory
+        self.name_dict = name_dict
+        self.roster_index = roster_index
+        self.log_file = log_file
+        self.guard = guard if guard is not None else ExtractionGuard(target_directory)
+        self.decisions = {}        # LMS folder name -> resolve_folder result
+        self.folder_targets = {}   # LMS folder name -> destination folder path
+        self.destinations = set()
+        self.claimed = {}          # written path -> LMS folder that wrote it
+        self.created_dirs = set()
+        self.file_times = []
+        self.dir_times = []
+        self.listings = {}         # destination folder name -> {rel_path: report entry}
+
+    # Maps an LMS folder name to its destination folder, logging the decision once
+    def destination_for(self, folder):
+        if folder in self.folder_targets:
+            return self.folder_targets[folder]
+
+        new_name, message, log_text = self.decisions[folder]
+        if message:
+            print(message)
+        if log_text:
+            self.log_file.write(log_text)
+        if new_name is None:
+            new_name = submission_unzip.member_target_path(folder, '')  # Kept as is, minus unsafe characters
+
+        destination = os.path.join(self.target_directory, new_name)
+        if destination in self.destinations:
+            self.log_file.write(f"\nMERGE: '{folder}' → existing '{new_name}'\n")
+        elif new_name != folder:
+            print(f"Extracting '{folder}' to '{new_name}'")
+        self.folder_targets[folder] = destination
+        self.destinations.add(destination)
+        return destination
+
+    # Picks the path a file is written to. Files from the same LMS folder overwrite
+    # each other as a plain extraction would; a clash with another submission of
+    # the same student gets an _1, _2... suffix, as merge_folder_contents does.
+    def claim(self, target_path, folder):
+        owner = self.claimed.get(target_path)
+        if owner == folder or (owner is None and not os.path.exists(target_path)):
+            self.claimed[target_path] = folder
+            return target_path
+        base, ext = os.path.splitext(target_path)
+        counter = 1
+        candidate = f"{base}_{counter}{ext}"
+        while candidate in self.claimed or os.path.exists(candidate):
+            counter += 1
+            candidate = f"{base}_{counter}{ext}"
+        self.claimed[candidate] = folder
+        source_path = os.path.relpath(target_path, self.folder_targets.get(folder, self.target_directory))
+        self.log_file.write(f"  Moved file: {os.path.join(folder, source_path)} → {candidate}\n")
+        return candidate
+
+    # Remembers what was written where, so the report does not have to rescan it.
+    # A path written again (a later member overwriting it) keeps its latest entry.
+    def record(self, target_path, is_dir, size, mtime):
+        folder, _, rel_path = os.path.relpath(target_path, self.target_directory).partition(os.sep)
+        if rel_path:
+            self.listings.setdefault(folder, {})[rel_path] = (rel_path, is_dir, size, mtime)
+
+    # Writes the members of an open archive under dest_dir; inner ZIPs are
+    # opened from the parent archive and expanded in place instead of being written
+    def extract_members(self, zip_ref, members, dest_dir, folder, depth=0):
+        mtime_cache = submission_unzip.member_mtimes(members)
+        for zip_info, rel_name in members.items():
+            target_path = submission_unzip.member_target_path(rel_name, dest_dir)
+            mtime = mtime_cache[zip_info.date_time]
+            if zip_info.is_dir():
+                if target_path != dest_dir:
+                    os.makedirs(target_path, exist_ok=True)
+                    self.created_dirs.add(target_path)
+                    self.dir_times.append((target_path, mtime))
+                    self.record(target_path, True, 0, mtime)
+            elif rel_name.endswith('.zip'):
+                self.extract_inner_zip(zip_ref, zip_info, os.path.dirname(target_path), folder, depth)
+            else:
+                target_path = self.claim(target_path, folder)
+                submission_unzip.write_member(zip_ref, zip_info, target_path, self.created_dirs)
+                self.file_times.append((target_path, mtime))
+                self.record(target_path, False, zip_info.file_size, mtime)
+
+    def extract_inner_zip(self, zip_ref, zip_info, dest_dir, folder, depth):
+        filename = os.path.basename(zip_info.filename)
+        with zip_ref.open(zip_info) as src:
+            if zip_info.file_size <= IN_MEMORY_ZIP_LIMIT:
+                spool = io.BytesIO(src.read())
+            else:
+                spool = tempfile.TemporaryFile()
+                shutil.copyfileobj(src, spool, submission_unzip.COPY_BUFFER_SIZE)
+        with spool:
+            try:
+                with zipfile.ZipFile(spool) as inner:
+                    infos = inner.infolist()
+                    self.guard.check(os.path.join(dest_dir, filename), infos, depth)
+                    members = {info: info.filename for info in infos}
+                    self.extract_members(inner, members, dest_dir, folder, depth + 1)
+            except LimitExceeded as e:
+                target_path = self.write_spool(spool, zip_info, dest_dir, folder)
+                quarantine_path = self.guard.quarantine(target_path, e)
+                print(f"Quarantined {filename} - {e} (moved to {quarantine_path})")
+                return
+            except zipfile.BadZipFile:
+                print(f"Failed to unzip {filename} - not a zip file or corrupted.")
+                # Keep the broken upload so it can be looked at
+                target_path = self.write_spool(spool, zip_info, dest_dir, folder)
+                self.record(target_path, False, zip_info.file_size, os.path.getmtime(target_path))
+                return
+        print(f"Unzipped {filename} in {dest_dir}")
+
+    # Writes an inner ZIP that is not extracted out as a file; returns its path
+    def write_spool(self, spool, zip_info, dest_dir, folder):
+        spool.seek(0)
+        target_path = self.claim(os.path.join(dest_dir, os.path.basename(zip_info.filename)), folder)
+        os.makedirs(dest_dir, exist_ok=True)
+        with open(target_path, 'wb') as dst:
+            shutil.copyfileobj(spool, dst, submission_unzip.COPY_BUFFER_SIZE)
+        return target_path
+
+    def extract(self, bulk_zip_path):
+        with zipfile.ZipFile(bulk_zip_path, 'r') as outer:
+            # Group the members by LMS folder so each student is written in one go
+            by_folder = {}
+            for zip_info in outer.infolist():
+                folder, _, rel_name = zip_info.filename.partition('/')
+                if not rel_name:
+                    if zip_info.is_dir():
+                        continue
+                    folder, rel_name = '', zip_info.filename
+                by_folder.setdefault(folder, {})[zip_info] = rel_name
+
+            # Resolved together, so that a fuzzy match is never merged into another folder
+            existing = [entry.name for entry in os.scandir(self.target_directory) if entry.is_dir()]
+            self.decisions = resolve_folders([folder for folder in by_folder if folder], existing + list(by_folder),
+                                             self.name_dict, self.roster_index)
+            for folder, members in by_folder.items():
+                dest_dir = self.destination_for(folder) if folder else self.target_directory
+                os.makedirs(dest_dir, exist_ok=True)
+                self.extract_members(outer, members, dest_dir, folder)
+        submission_unzip.restore_timestamps(self.file_times, self.dir_times)
+
+
+# Extracts an LMS bulk download straight into renamed student folders.
+# Returns the listing of everything written, per student folder, for
+# write_submission_report to reuse; None if the target already had content,
+# since the listing would then be incomplete. Inner ZIPs over the limits of
+# `guard` (by default submission_guard's) are quarantined.
+def extract_bulk_download(bulk_zip_path, target_directory, name_dict, log_path, roster_index=None, guard=None):
+    if roster_index is None:
+        roster_index = submission_roster.RosterIndex.from_name_dict(name_dict)
+    os.makedirs(target_directory, exist_ok=True)
+    fresh_target = not os.listdir(target_directory)
+    with open(log_path, 'w', encoding='utf-8') as log_file:
+        extractor = BulkExtractor(target_directory, name_dict, roster_index, log_file, guard)
+        extractor.extract(bulk_zip_path)
+    if not fresh_target:
+        return None
+    return {folder: list(entries.values()) for folder, entries in extractor.listings.items()}
+
+
+if __name__ == "__main__":
+    bulk_zip_path = input("Enter the LMS bulk download ZIP (full path + filename needed): ").strip()
+    if not zipfile.is_zipfile(bulk_zip_path):
+        print("The specified bulk download is not a ZIP file. Please check the path and try again.")
+    else:
+        target_directory = input("Enter the dir. to extract the student submissions into: ").strip()
+        csv_path = input("Enter the filename that has student name and group (full path + filename needed): ").strip()
+        if not os.path.isfile(csv_path):
+            print("The specified CSV file does not exist. Please check the path and try again.")
+        else:
+            name_dict = read_name_list(csv_path)
+            log_file_path = os.path.join(target_directory, 'merge_log.txt')
+            listings = extract_bulk_download(bulk_zip_path, target_directory, name_dict, log_file_path)
+            write_submission_report(target_directory, listings=listings)
+
+            print(f"\n✅ Merge log saved to: {log_file_path}")
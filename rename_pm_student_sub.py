@@ -1,21 +1,15 @@
-import csv
 import os
-import time
-import zipfile
-import shutil
 from datetime import datetime
 
+import submission_merge
+import submission_roster
+import submission_unzip
+
 # Reads student metadata from a CSV file and returns a dictionary
 # where the key is the cleaned, normalized name (uppercase, no commas, single spacing),
 # and the value is a list [student_id, class, team]
 def read_name_list(csv_path):
-    student_dict = {}
-    with open(csv_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            clean_name = ' '.join(row['name'].strip().upper().replace(',', '').split())
-            student_dict[clean_name] = [row['student_id'], row['class'], row['team']]
-    return student_dict
+    return submission_roster.load_roster(csv_path).name_dict()
 
 # Extracts the student name from the folder name string.
 # Assumes the format: "<some id> - <name> SOI..."
@@ -31,29 +25,9 @@ def extract_name_from_folder(folder_name):
     except ValueError:
         return ""
 
-# Recursively merges the contents of one folder into another.
-# Handles both files and subdirectories.
+# Recursively merges the contents of one folder into another (see submission_merge).
 # If a filename already exists in the destination, appends _1, _2, etc.
-def merge_folder_contents(src_folder, dst_folder, log_file):
-    for item in os.listdir(src_folder):
-        src_path = os.path.join(src_folder, item)
-        dst_path = os.path.join(dst_folder, item)
-
-        if os.path.isdir(src_path):
-            if os.path.exists(dst_path):
-                log_file.write(f"  Recursively merging folder: {src_path} → {dst_path}\n")
-                merge_folder_contents(src_path, dst_path, log_file)
-            else:
-                shutil.move(src_path, dst_path)
-                log_file.write(f"  Moved folder: {src_path} → {dst_path}\n")
-        else:
-            base, ext = os.path.splitext(item)
-            counter = 1
-            while os.path.exists(dst_path):
-                dst_path = os.path.join(dst_folder, f"{base}_{counter}{ext}")
-                counter += 1
-            shutil.move(src_path, dst_path)
-            log_file.write(f"  Moved file: {src_path} → {dst_path}\n")
+merge_folder_contents = submission_merge.merge_folder_contents
 
 # Renames student folders using team_name + cleaned_name + student_id.
 # If the target folder already exists, merges content into it.
@@ -85,26 +59,11 @@ def rename_directory(target_directory, name_dict, log_path):
 
 # Recursively unzips all ZIP files in a given directory (and subdirectories),
 # restoring the original timestamps.
-def unzip_all_zip_files(directory):
-    while True:
-        found_zip = False
-        for root, dirs, files in os.walk(directory):
-            for filename in files:
-                if filename.endswith('.zip'):
-                    zip_path = os.path.join(root, filename)
-                    try:
-                        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                            for zip_info in zip_ref.infolist():
-                                extracted_path = zip_ref.extract(zip_info, path=root)
-                                date_time = time.mktime(zip_info.date_time + (0, 0, -1))
-                                os.utime(extracted_path, (date_time, date_time))
-                        print(f"Unzipped {filename} in {root}")
-                        os.remove(zip_path)  # Optional: delete zip after extraction
-                        found_zip = True
-                    except zipfile.BadZipFile:
-                        print(f"Failed to unzip {filename} - not a zip file or corrupted.")
-        if not found_zip:
-            break
+# With workers > 1, student folders are extracted in parallel.
+# Archives over the extraction limits (zip bombs, ZIPs nested too deep) are
+# quarantined to ../__quarantine instead of being extracted.
+def unzip_all_zip_files(directory, workers=1, guard=None):
+    return submission_unzip.unzip_all_zip_files(directory, workers=workers, guard=guard)
 
 
 # Creates a hierarchical text report of all student submission folders.
@@ -145,7 +104,8 @@ if __name__ == "__main__":
         if not os.path.isfile(csv_path):
             print("The specified CSV file does not exist. Please check the path and try again.")
         else:
-            unzip_all_zip_files(target_directory)
+            workers = input("Enter the number of parallel unzip workers (press Enter for 1): ").strip()
+            unzip_all_zip_files(target_directory, int(workers) if workers else 1)
 
             name_dict = read_name_list(csv_path)
             log_file_path = os.path.join(target_directory, 'merge_log.txt')
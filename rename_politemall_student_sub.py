@@ -1,19 +1,21 @@
-import csv
+import asyncio
 import os
-import time
-import zipfile
-import shutil
-from datetime import datetime
+
+import submission_backup
+import submission_dedupe
+import submission_guard
+import submission_manifest
+import submission_merge
+import submission_memory
+import submission_metrics
+import submission_plan
+import submission_report
+import submission_roster
+import submission_unzip
 
 # 1. Reads student list from CSV and normalizes names
 def read_name_list(csv_path):
-    student_dict = {}
-    with open(csv_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            clean_name = ' '.join(row['name'].strip().upper().replace(',', '').split())
-            student_dict[clean_name] = [row['student_id'], row['class'], row['team']]
-    return student_dict
+    return submission_roster.load_roster(csv_path).name_dict()
 
 # 2. Extracts and cleans student name from folder name
 def extract_name_from_folder(folder_name):
@@ -29,135 +31,574 @@ def extract_name_from_folder(folder_name):
         return ""
 
 
-# 3. Merges contents of two folders, handling name conflicts
-def merge_folder_contents(src_folder, dst_folder, log_file):
-    for item in os.listdir(src_folder):
-        src_path = os.path.join(src_folder, item)
-        dst_path = os.path.join(dst_folder, item)
+# 3. Merges contents of two folders, handling name conflicts (see submission_merge)
+merge_folder_contents = submission_merge.merge_folder_contents
 
-        if os.path.isdir(src_path):
-            if os.path.exists(dst_path):
-                log_file.write(f"  Recursively merging folder: {src_path} → {dst_path}\n")
-                merge_folder_contents(src_path, dst_path, log_file)
-            else:
-                shutil.move(src_path, dst_path)
-                log_file.write(f"  Moved folder: {src_path} → {dst_path}\n")
-        else:
-            base, ext = os.path.splitext(item)
-            counter = 1
-            while os.path.exists(dst_path):
-                dst_path = os.path.join(dst_folder, f"{base}_{counter}{ext}")
-                counter += 1
-            shutil.move(src_path, dst_path)
-            log_file.write(f"  Moved file: {src_path} → {dst_path}\n")
-
-# 4. Renames folders or merges if target name exists
-def rename_directory(target_directory, name_dict, log_path):
-    with open(log_path, 'w', encoding='utf-8') as log_file:
-        for item in os.listdir(target_directory):
-            item_path = os.path.join(target_directory, item)
-            if os.path.isdir(item_path):
-                extracted_name = extract_name_from_folder(item)
-                name_key = extracted_name.strip().upper()
-                if name_key in name_dict:
-                    student_id, class_, team = name_dict[name_key]
-                    sanitized_name = extracted_name.replace('/', '')
-                    new_name = f"{team}_{sanitized_name}_{student_id}"
-                    new_path = os.path.join(target_directory, new_name)
-
-                    if os.path.exists(new_path):
-                        log_file.write(f"\nMERGE: '{item}' → existing '{new_name}'\n")
-                        merge_folder_contents(item_path, new_path, log_file)
-                        os.rmdir(item_path)
-                        print(f"Merged and removed folder '{item}'")
-                    else:
-                        os.rename(item_path, new_path)
-                        print(f"Renamed '{item}' to '{new_name}'")
-                else:
-                    print(f"[SKIPPED] Name '{extracted_name}' not found in CSV.")
-                    log_file.write(f"\nSKIPPED: '{item}' → No match for extracted name '{extracted_name}'\n")
+# 4. Works out the new name of a submission folder.
+# Returns (new_name or None, message to print or None, text for the merge log or None).
+# Without an exact name match, a roster index resolves the folder by student ID
+# or fuzzy name match, and the confidence is logged for review. The new name
+# always uses the roster's normalised name, whatever the folder's spelling, so
+# every submission of a student ends up in the same folder.
+# A fuzzy match may name a different student, so it is only applied if the
+# index allows it (see RosterIndex.applies) and its new name is not in `taken`;
+# otherwise the folder is skipped and the match logged as a suggestion.
+def resolve_folder(item, name_dict, roster_index=None, taken=()):
+    extracted_name = extract_name_from_folder(item)
+    name_key = extracted_name.strip().upper()
+    if name_key in name_dict:
+        student_id, class_, team = name_dict[name_key]
+        return new_folder_name(team, name_key, student_id), None, None
+
+    match = roster_index.match_folder(item) if roster_index is not None else None
+    if match is not None:
+        new_name = new_folder_name(match.team, match.name, match.student_id)
+        fuzzy_merge = match.method == 'fuzzy' and new_name != item and new_name in taken
+        if roster_index.applies(match) and not fuzzy_merge:
+            return (new_name,
+                    f"[MATCHED] '{item}' → '{match.name}' by {match.method} ({match.confidence:.2f})",
+                    f"\nMATCHED: '{item}' → '{match.name}' by {match.method} (confidence {match.confidence:.2f})\n")
+        return (None,
+                f"[SKIPPED] Name '{extracted_name}' not found in CSV; did you mean '{match.name}' "
+                f"({match.confidence:.2f})? Check it and rename the folder by hand.",
+                f"\nSKIPPED: '{item}' → No match for extracted name '{extracted_name}'; "
+                f"SUGGESTION: '{match.name}' {match.student_id} by {match.method} "
+                f"(confidence {match.confidence:.2f})\n")
+    return (None,
+            f"[SKIPPED] Name '{extracted_name}' not found in CSV.",
+            f"\nSKIPPED: '{item}' → No match for extracted name '{extracted_name}'\n")
+
+# Resolves several folders at once; returns {item: resolve_folder result}.
+# `existing` are the names of every folder in the directory. A fuzzy match is
+# never merged: one whose new name is already a folder, or is the new name of
+# another of the items too, is only logged as a suggestion.
+def resolve_folders(items, existing, name_dict, roster_index=None):
+    decisions = {item: resolve_folder(item, name_dict, roster_index) for item in items}
+    destinations = {}
+    for new_name, _, _ in decisions.values():
+        if new_name is not None:
+            destinations[new_name] = destinations.get(new_name, 0) + 1
+    taken = set(existing) | {new_name for new_name, count in destinations.items() if count > 1}
+    for item, (new_name, _, _) in decisions.items():
+        if new_name is not None and new_name != item and new_name in taken:
+            decisions[item] = resolve_folder(item, name_dict, roster_index, taken)
+    return decisions
+
+def new_folder_name(team, name, student_id):
+    return f"{team}_{name.replace('/', '')}_{student_id}"
+
+# Renames one folder, or merges it into the folder that already has the new name.
+# Returns ('renamed' or 'merged', message, paths the merge gave a _1, _2... name).
+def move_to_new_name(target_directory, item, new_name, log_file):
+    item_path = os.path.join(target_directory, item)
+    new_path = os.path.join(target_directory, new_name)
+    if os.path.exists(new_path):
+        log_file.write(f"\nMERGE: '{item}' → existing '{new_name}'\n")
+        renamed = merge_folder_contents(item_path, new_path, log_file)
+        os.rmdir(item_path)
+        return 'merged', f"Merged and removed folder '{item}'", renamed
+    os.rename(item_path, new_path)
+    return 'renamed', f"Renamed '{item}' to '{new_name}'", []
+
+# Renames folders or merges if target name exists.
+# With a manifest, folders renamed by an earlier run are left alone and the
+# log is appended to rather than overwritten. Messages and counts go through
+# `metrics` (see submission_metrics) when given.
+def rename_directory(target_directory, name_dict, log_path, manifest=None, roster_index=None, metrics=None):
+    if metrics is None:
+        metrics = submission_metrics.RunMetrics(progress_interval=None)
+    processed = manifest.processed_folders() if manifest is not None else set()
+    existing = [item for item in os.listdir(target_directory) if os.path.isdir(os.path.join(target_directory, item))]
+    decisions = resolve_folders([item for item in existing if item not in processed], existing, name_dict,
+                                roster_index)
+    with open(log_path, 'a' if manifest is not None else 'w', encoding='utf-8') as log_file:
+        for item in existing:
+            if item in decisions:
+                new_name, message, log_text = decisions[item]
+                metrics.add('rename', folders=1)
+                if message:
+                    metrics.log(message)
+                if log_text:
+                    log_file.write(log_text)
+                if new_name is None:
+                    if manifest is not None:
+                        manifest.record_rename(item, None)
+                    continue
+                if new_name == item:
+                    continue  # Already renamed, e.g. matched by the ID in its own name
+
+                action, message, renamed = move_to_new_name(target_directory, item, new_name, log_file)
+                metrics.add('rename', **{action: 1})
+                metrics.log(message)
+                if manifest is not None:
+                    manifest.record_rename(item, new_name)
+                    manifest.record_merge_copies(renamed)
+    if manifest is not None:
+        manifest.save()
 
 # 5. Recursively unzips all ZIP files (including nested ZIPs)
-def unzip_all_zip_files(directory):
-    while True:
-        found_zip = False
-        for root, dirs, files in os.walk(directory):
-            for filename in files:
-                if filename.endswith('.zip'):
-                    zip_path = os.path.join(root, filename)
-                    try:
-                        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                            for zip_info in zip_ref.infolist():
-                                extracted_path = zip_ref.extract(zip_info, path=root)
-                                date_time = time.mktime(zip_info.date_time + (0, 0, -1))
-                                os.utime(extracted_path, (date_time, date_time))
-                        print(f"Unzipped {filename} in {root}")
-                        os.remove(zip_path)  # Remove ZIP after extraction
-                        found_zip = True
-                    except zipfile.BadZipFile:
-                        print(f"Failed to unzip {filename} - not a zip file or corrupted.")
-        if not found_zip:
-            break
-
-# 6. Backs up all ZIP files to ../__backup_zips with original names
-def backup_zip_files_to_parent(directory):
+# With workers > 1, student folders are extracted in parallel, on threads or,
+# with use_processes, in worker processes (for CPU-bound deflate on many cores).
+# With a manifest, archives that failed before and are unchanged are not retried.
+# With metrics, every archive's extraction time is recorded.
+# Archives over the size, ratio or nesting limits of `guard` (by default
+# submission_guard's) are quarantined to ../__quarantine without being extracted.
+# With low_memory, nothing is kept per extracted file (see submission_unzip.extract_zip_file).
+def unzip_all_zip_files(directory, workers=1, manifest=None, metrics=None, guard=None, low_memory=False,
+                        use_processes=False):
+    if metrics is None:
+        metrics = submission_metrics.RunMetrics(progress_interval=None)
+    if guard is None:
+        guard = submission_guard.ExtractionGuard(directory)
+    zip_paths = submission_unzip.find_zip_files(directory)
+    if manifest is not None:
+        zip_paths = [p for p in zip_paths if not manifest.archive_unchanged(p, status='failed')
+                     and not manifest.in_redownloaded_folder(p)]
+    errors = submission_unzip.unzip_zip_files(directory, zip_paths, workers, use_processes, log=metrics.log,
+                                              on_archive=metrics.record_archive, guard=guard,
+                                              low_memory=low_memory)
+    quarantined = sum(1 for _, reason in errors if reason.startswith('quarantined'))
+    metrics.add('unzip', failed=len(errors) - quarantined, quarantined=quarantined)
+    if manifest is None:
+        return errors
+
+    failed = {path for path, _ in errors}
+    for zip_path in zip_paths:
+        if zip_path not in failed:
+            manifest.mark_archive_extracted(zip_path)
+        elif os.path.isfile(zip_path):
+            manifest.record_archive(zip_path, status='failed')
+    manifest.save()
+    return errors
+
+# Backs up one ZIP as backup_dir/flat_name unless its content is already there.
+# `digest` is the archive's SHA-256 if already known. Returns (digest, message,
+# bytes backed up or None if skipped); hash_index and backup_hashes are updated.
+def backup_zip_file(original_path, flat_name, backup_dir, hash_index, backup_hashes, strategy='auto', digest=None):
+    if digest is None:
+        digest = submission_backup.file_sha256(original_path)
+    if digest in hash_index:
+        return digest, f"⏭️ Backup already exists: {os.path.join(backup_dir, hash_index[digest])}", None
+
+    backup_path = os.path.join(backup_dir, flat_name)
+    used = submission_backup.backup_file(original_path, backup_path, strategy)
+    # An older backup under the same name has just been replaced
+    hash_index.pop(backup_hashes.get(flat_name), None)
+    hash_index[digest] = flat_name
+    backup_hashes[flat_name] = digest
+    return digest, f"🔄 Backup created: {backup_path} ({used})", os.path.getsize(backup_path)
+
+# 6. Backs up all ZIP files to ../__backup_zips with original names.
+# The strategy is one of submission_backup.BACKUP_STRATEGIES; ZIPs whose content
+# is already in the backup folder are skipped, so re-running a batch is cheap.
+# With a manifest, archives recorded with the same size and mtime are not re-hashed,
+# and re-downloaded copies of folders renamed by an earlier run are left alone.
+def backup_zip_files_to_parent(directory, strategy='auto', manifest=None, metrics=None):
+    if metrics is None:
+        metrics = submission_metrics.RunMetrics(progress_interval=None)
     parent_dir = os.path.dirname(directory)
     backup_dir = os.path.join(parent_dir, '__backup_zips')
     os.makedirs(backup_dir, exist_ok=True)
+    hash_index = submission_backup.load_hash_index(backup_dir)
+    backup_hashes = {name: digest for digest, name in hash_index.items()}
 
-    for root, _, files in os.walk(directory):
+    redownloaded = manifest.redownloaded_folders() if manifest is not None else {}
+    for root, dirs, files in os.walk(directory):
+        if root == directory:
+            dirs[:] = [d for d in dirs if d not in redownloaded]
         for filename in files:
             if filename.endswith('.zip'):
                 original_path = os.path.join(root, filename)
-                rel_path = os.path.relpath(original_path, directory)
-                flat_name = rel_path.replace(os.sep, '_')
-                backup_path = os.path.join(backup_dir, flat_name)
+                flat_name = os.path.relpath(original_path, directory).replace(os.sep, '_')
 
-                shutil.copy2(original_path, backup_path)
-                print(f"🔄 Backup created: {backup_path}")
+                known = None
+                if manifest is not None and manifest.archive_unchanged(original_path):
+                    known = manifest.archive_hash(original_path)
+                digest, message, size = backup_zip_file(original_path, flat_name, backup_dir, hash_index,
+                                                        backup_hashes, strategy, known)
+                if known is None and manifest is not None:
+                    manifest.record_archive(original_path, digest)
+                if size is None:
+                    metrics.add('backup', skipped=1)
+                else:
+                    metrics.add('backup', files=1, bytes=size)
+                metrics.log(message)
+
+    submission_backup.save_hash_index(backup_dir, hash_index)
+    if manifest is not None:
+        manifest.save()
 
-# 7. Creates submission report with folder/files and timestamps
-def write_submission_report(directory, report_filename="submission_report.txt"):
+# 7. Creates submission report with folder/files and timestamps.
+# fmt is 'text' (indented listing), 'jsonl' or 'csv'; with a deadline, files
+# modified after it are flagged as late. With a manifest, folders unchanged
+# since the last run reuse their cached text block, unless low_memory asks for
+# the report to be written line by line instead.
+def write_submission_report(directory, report_filename="submission_report.txt", manifest=None,
+                            fmt='text', deadline=None, listings=None, metrics=None, low_memory=False):
     report_path = os.path.join(directory, report_filename)
-    top_items = sorted(os.listdir(directory))
-
-    with open(report_path, 'w', encoding='utf-8') as rpt:
-        for folder in top_items:
-            folder_path = os.path.join(directory, folder)
-            if os.path.isdir(folder_path):
-                rpt.write(f"{folder}\n")
-                for root, dirs, files in os.walk(folder_path):
-                    level = root.replace(folder_path, '').count(os.sep) + 1
-                    indent = '  ' * level
-                    for d in sorted(dirs):
-                        rpt.write(f"{indent}{d}/\n")
-                    for f in sorted(files):
-                        f_path = os.path.join(root, f)
-                        mtime = os.path.getmtime(f_path)
-                        timestamp = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
-                        rpt.write(f"{indent}{f} ({timestamp})\n")
-                rpt.write("\n")
-        rpt.write("End of Report\n")
+    submission_report.write_report(directory, report_path, fmt, deadline, listings, manifest, metrics,
+                                   low_memory)
     print(f"📄 Submission report saved to: {report_path}")
 
-# 8. Main execution
+# 8. Unzips and renames/merges as a planned, journaled run (see submission_plan).
+# With dry_run the plan is only printed. An unfinished earlier run is resumed
+# from its journal instead of being planned again.
+def unzip_and_rename_planned(target_directory, name_dict, log_path, manifest=None, roster_index=None,
+                             dry_run=False, guard=None):
+    zip_paths = submission_unzip.find_zip_files(target_directory)
+    if manifest is not None:
+        zip_paths = [p for p in zip_paths if not manifest.archive_unchanged(p, status='failed')
+                     and not manifest.in_redownloaded_folder(p)]
+    skip = manifest.processed_folders() if manifest is not None else set()
+    skip.add(submission_plan.TRASH_NAME)
+
+    # Every folder is resolved up front from the listing the plan starts from
+    def plan_renames(view):
+        existing = [item for item, is_dir in view.listing(target_directory).items() if is_dir]
+        decisions = resolve_folders([item for item in existing if item not in skip], existing, name_dict,
+                                    roster_index)
+        return submission_plan.plan_renames(target_directory, decisions.__getitem__, view, skip)
+
+    if dry_run:
+        if submission_plan.has_unfinished_run(target_directory):
+            print("[DRY RUN] An unfinished run exists and would be resumed instead.")
+        view = submission_plan.TreeView(submission_plan.predict_extraction(zip_paths))
+        ops = submission_plan.plan_extractions(zip_paths)
+        ops += plan_renames(view)
+        submission_plan.print_plan(ops)
+        return ops
+
+    with open(log_path, 'a' if manifest is not None else 'w', encoding='utf-8') as log_file:
+        submission_plan.run_plan(
+            target_directory, log_file,
+            lambda: submission_plan.plan_extractions(zip_paths),
+            lambda: plan_renames(submission_plan.TreeView()),
+            manifest, guard or submission_guard.ExtractionGuard(target_directory))
+    if manifest is not None:
+        for zip_path in zip_paths:
+            if os.path.exists(zip_path):
+                manifest.record_archive(zip_path, status='failed')
+            else:
+                manifest.mark_archive_extracted(zip_path)
+        manifest.save()
+    return None
+
+# 9. Streams each student folder through backup, unzip, rename/merge and report
+# scanning as soon as its previous stage is done, so that one student's disk
+# work overlaps another's decompression. Blocking work runs in threads
+# (asyncio.to_thread) and the stages are linked by queues of queue_size folders,
+# so a slow stage holds the earlier ones back instead of piling up work.
+#   - backup runs one folder at a time, as the backup hash index is shared
+#   - unzip and report scanning run `workers` folders at a time
+#   - renames/merges are applied one at a time in directory-listing order, each
+#     once the folder and the folder it merges into are unzipped, so the result
+#     is the same as running the stages one after the other
+# A destination folder is scanned for the report once every folder going into
+# it has been renamed or merged. The manifest is only updated from the event
+# loop. Returns the listings for write_submission_report; with low_memory none
+# are kept and the report scans the folders again.
+async def stream_submission_directory(target_directory, name_dict, log_path, manifest=None, roster_index=None,
+                                      strategy='auto', workers=4, metrics=None, guard=None, queue_size=8,
+                                      low_memory=False):
+    if metrics is None:
+        metrics = submission_metrics.RunMetrics(progress_interval=None)
+    if guard is None:
+        guard = submission_guard.ExtractionGuard(target_directory)
+    backup_dir = os.path.join(os.path.dirname(target_directory), '__backup_zips')
+    os.makedirs(backup_dir, exist_ok=True)
+    hash_index = submission_backup.load_hash_index(backup_dir)
+    backup_hashes = {name: digest for digest, name in hash_index.items()}
+    processed = manifest.processed_folders() if manifest is not None else set()
+
+    # ZIPs lying directly in the directory may extract into any folder, so they go first
+    top_zips = [entry.path for entry in os.scandir(target_directory)
+                if entry.is_file() and entry.name.endswith('.zip')]
+
+    def known_digest(zip_path):
+        if manifest is not None and manifest.archive_unchanged(zip_path):
+            return manifest.archive_hash(zip_path)
+        return None
+
+    # Runs in a thread; only reads the manifest
+    def backup_zips(zip_paths):
+        results = []
+        for zip_path in zip_paths:
+            known = known_digest(zip_path)
+            flat_name = os.path.relpath(zip_path, target_directory).replace(os.sep, '_')
+            results.append((zip_path, known) + backup_zip_file(zip_path, flat_name, backup_dir, hash_index,
+                                                               backup_hashes, strategy, known))
+        return results
+
+    def record_backups(results):
+        for zip_path, known, digest, message, size in results:
+            if known is None and manifest is not None:
+                manifest.record_archive(zip_path, digest)
+            if size is None:
+                metrics.add('backup', skipped=1)
+            else:
+                metrics.add('backup', files=1, bytes=size)
+            metrics.log(message)
+
+    # Runs in a thread; only reads the manifest
+    def unzip_folder(folder_path):
+        zip_paths = submission_unzip.find_zip_files(folder_path)
+        if manifest is not None:
+            zip_paths = [p for p in zip_paths if not manifest.archive_unchanged(p, status='failed')]
+        messages = []
+        timings = []
+        errors = submission_unzip.unzip_worklist(zip_paths, messages.append,
+                                                 lambda *timing: timings.append(timing), guard, low_memory)
+        return zip_paths, messages, timings, errors
+
+    def record_unzip(zip_paths, messages, timings, errors):
+        for message in messages:
+            metrics.log(message)
+        for timing in timings:
+            metrics.record_archive(*timing)
+        quarantined = sum(1 for _, reason in errors if reason.startswith('quarantined'))
+        metrics.add('unzip', failed=len(errors) - quarantined, quarantined=quarantined)
+        if manifest is not None:
+            failed = {path for path, _ in errors}
+            for zip_path in zip_paths:
+                if zip_path not in failed:
+                    manifest.mark_archive_extracted(zip_path)
+                elif os.path.isfile(zip_path):
+                    manifest.record_archive(zip_path, status='failed')
+
+    if top_zips:
+        record_backups(await asyncio.to_thread(backup_zips, top_zips))
+        errors = await asyncio.to_thread(submission_unzip.unzip_worklist, top_zips, metrics.log,
+                                         metrics.record_archive, guard, low_memory)
+        record_unzip(top_zips, [], [], errors)
+
+    # Listed only now, so that folders coming out of the top-level ZIPs are included
+    redownloaded = manifest.redownloaded_folders() if manifest is not None else {}
+    existing = [item for item in os.listdir(target_directory)
+                if os.path.isdir(os.path.join(target_directory, item)) and item != submission_plan.TRASH_NAME]
+    folders = [item for item in existing if item not in redownloaded]
+
+    # New names are worked out up front, to know which folders go into each destination
+    decisions = resolve_folders([item for item in folders if item not in processed], existing, name_dict,
+                                roster_index)
+    remaining = {}
+    for item in folders:
+        decision = decisions.setdefault(item, None)  # None: renamed by an earlier run
+        destination = decision[0] if decision is not None and decision[0] is not None else item
+        remaining[destination] = remaining.get(destination, 0) + 1
+
+    backup_queue = asyncio.Queue(queue_size)
+    unzip_queue = asyncio.Queue(queue_size)
+    rename_queue = asyncio.Queue(queue_size)
+    report_queue = asyncio.Queue(queue_size)
+    listings = {}
+
+    async def feed():
+        for item in folders:
+            await backup_queue.put(item)
+        await backup_queue.put(None)
+
+    async def backup_stage():
+        while (item := await backup_queue.get()) is not None:
+            folder_path = os.path.join(target_directory, item)
+            zip_paths = await asyncio.to_thread(submission_unzip.find_zip_files, folder_path)
+            record_backups(await asyncio.to_thread(backup_zips, zip_paths))
+            await unzip_queue.put(item)
+        await asyncio.to_thread(submission_backup.save_hash_index, backup_dir, hash_index)
+        for _ in range(workers):
+            await unzip_queue.put(None)
+
+    async def unzip_stage():
+        while (item := await unzip_queue.get()) is not None:
+            record_unzip(*await asyncio.to_thread(unzip_folder, os.path.join(target_directory, item)))
+            await rename_queue.put(item)
+        await rename_queue.put(None)
+
+    async def rename_stage():
+        unzipped = set()
+        finished_unzippers = 0
+        position = 0
+        with open(log_path, 'a' if manifest is not None else 'w', encoding='utf-8') as log_file:
+            while finished_unzippers < workers:
+                # Take everything on offer, so the unzip workers are never held up by the ordering
+                item = await rename_queue.get()
+                if item is None:
+                    finished_unzippers += 1
+                    continue
+                unzipped.add(item)
+
+                while position < len(folders) and folders[position] in unzipped:
+                    item = folders[position]
+                    decision = decisions[item]
+                    new_name = decision[0] if decision is not None else None
+                    if new_name in decisions and new_name != item and new_name not in unzipped:
+                        break  # Merges into a folder that is still being unzipped
+                    position += 1
+                    await apply_rename(item, decision, log_file)
+                    destination = new_name if new_name is not None else item
+                    remaining[destination] -= 1
+                    if remaining[destination] == 0:
+                        await report_queue.put(destination)
+        if position < len(folders):
+            raise RuntimeError("Unzip stage finished without handing over every folder")
+        if manifest is not None:
+            manifest.save()
+        for _ in range(workers):
+            await report_queue.put(None)
+
+    async def apply_rename(item, decision, log_file):
+        if decision is None:
+            return  # Renamed by an earlier run
+        new_name, message, log_text = decision
+        metrics.add('rename', folders=1)
+        if message:
+            metrics.log(message)
+        if log_text:
+            log_file.write(log_text)
+        if new_name is None:
+            if manifest is not None:
+                manifest.record_rename(item, None)
+            return
+        if new_name == item:
+            return
+        action, message, renamed = await asyncio.to_thread(move_to_new_name, target_directory, item, new_name,
+                                                           log_file)
+        metrics.add('rename', **{action: 1})
+        metrics.log(message)
+        if manifest is not None:
+            manifest.record_rename(item, new_name)
+            manifest.record_merge_copies(renamed)
+
+    async def report_stage():
+        while (folder := await report_queue.get()) is not None:
+            if low_memory:
+                continue
+            listings[folder] = await asyncio.to_thread(submission_report.folder_listing,
+                                                       os.path.join(target_directory, folder))
+            metrics.add('report', scanned=1)
+
+    tasks = [asyncio.ensure_future(coro) for coro in
+             [feed(), backup_stage(), rename_stage()] +
+             [unzip_stage() for _ in range(workers)] + [report_stage() for _ in range(workers)]]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    if manifest is not None:
+        manifest.save()
+    return listings
+
+# 10. Backs up, unzips, renames/merges and reports one submission directory.
+# The manifest makes re-runs (e.g. for late submissions) only touch new entries.
+# With transactional, unzip and rename/merge run as a journaled plan that can be
+# resumed or rolled back; dry_run only prints that plan and changes nothing.
+# Optionally collapses duplicate files (see submission_dedupe) before reporting.
+# Stage timings and counts are collected in `metrics` and saved to
+# pipeline_metrics.json in the directory. `limits` (submission_guard.ExtractionLimits)
+# overrides the default extraction limits. With streaming, backup, unzip and
+# rename/merge overlap across student folders (see stream_submission_directory).
+# A memory_budget (submission_memory.MemoryBudget) turns on the low-memory mode:
+# archives whose index would not fit in it are quarantined, no listings or
+# cached report blocks are kept, and the report is written line by line.
+# use_processes extracts student folders in worker processes instead of threads
+# (the phased unzip stage only; streaming and transactional runs use threads).
+def process_submission_directory(target_directory, name_dict, roster_index=None, strategy='auto', workers=1,
+                                 report_format='text', deadline=None, dedupe=False, hardlink_duplicates=False,
+                                 transactional=False, dry_run=False, metrics=None, limits=None, streaming=False,
+                                 memory_budget=None, use_processes=False):
+    low_memory = memory_budget is not None
+    manifest = submission_manifest.SubmissionManifest(target_directory)
+    if low_memory:
+        manifest.clear_reports()
+    if roster_index is None:
+        roster_index = submission_roster.RosterIndex.from_name_dict(name_dict)
+    if metrics is None:
+        metrics = submission_metrics.RunMetrics(memory_budget=memory_budget)
+    elif metrics.memory_budget is None:
+        metrics.memory_budget = memory_budget
+    guard = submission_guard.ExtractionGuard(target_directory, limits, memory_budget=memory_budget)
+    log_file_path = os.path.join(target_directory, 'merge_log.txt')
+    for folder, new_name in sorted(manifest.redownloaded_folders().items()):
+        metrics.log(f"⏭️ '{folder}' was already processed as '{new_name}' and is unchanged, skipping it")
+        metrics.add('rename', redownloaded=1)
+
+    if dry_run:
+        unzip_and_rename_planned(target_directory, name_dict, log_file_path, manifest, roster_index, dry_run=True)
+        return None
+
+    listings = None
+    if streaming and not transactional:
+        with metrics.stage('stream'):
+            listings = asyncio.run(stream_submission_directory(target_directory, name_dict, log_file_path, manifest,
+                                                               roster_index, strategy, workers, metrics, guard,
+                                                               low_memory=low_memory))
+    else:
+        with metrics.stage('backup'):
+            backup_zip_files_to_parent(target_directory, strategy, manifest, metrics)
+        if transactional:
+            with metrics.stage('unzip_rename'):
+                unzip_and_rename_planned(target_directory, name_dict, log_file_path, manifest, roster_index,
+                                         guard=guard)
+        else:
+            with metrics.stage('unzip'):
+                unzip_all_zip_files(target_directory, workers, manifest, metrics, guard, low_memory, use_processes)
+            with metrics.stage('rename'):
+                rename_directory(target_directory, name_dict, log_file_path, manifest, roster_index, metrics)
+
+    if dedupe:
+        listings = None  # Dedupe removes files the listings still have
+        with metrics.stage('dedupe'):
+            removed, linked, saved = submission_dedupe.dedupe_submissions(
+                target_directory, hardlink_across_students=hardlink_duplicates, manifest=manifest)
+            manifest.save()
+        metrics.add('dedupe', removed=removed, linked=linked, bytes=saved)
+
+    report_filename = 'submission_report.txt' if report_format == 'text' else f'submission_report.{report_format}'
+    with metrics.stage('report'):
+        write_submission_report(target_directory, report_filename, manifest, report_format, deadline, listings,
+                                metrics, low_memory)
+    metrics.write(os.path.join(target_directory, submission_metrics.METRICS_NAME))
+    return log_file_path
+
+# 11. Main execution
 if __name__ == "__main__":
     target_directory = input("Enter the dir. containing student submission: ").strip()
     if not os.path.exists(target_directory):
         print("The specified directory does not exist. Please check the path and try again.")
+    elif submission_plan.has_unfinished_run(target_directory) and input(
+            "An earlier run was interrupted. Enter 'b' to roll it back, or press Enter to resume it: "
+    ).strip().lower() == 'b':
+        submission_plan.rollback_run(target_directory, submission_manifest.SubmissionManifest(target_directory))
+        print("↩️ The interrupted run has been rolled back.")
     else:
         csv_path = input("Enter the filename that has student name and group (full path + filename needed): ").strip()
         if not os.path.isfile(csv_path):
             print("The specified CSV file does not exist. Please check the path and try again.")
         else:
-            # Backup, unzip, rename/merge, and report
-            backup_zip_files_to_parent(target_directory)
-            unzip_all_zip_files(target_directory)
-
+            strategy = input("Enter the backup strategy (auto/hardlink/reflink/copy, press Enter for auto): ").strip()
+            workers = input("Enter the number of parallel unzip workers (press Enter for 1): ").strip()
+            use_processes = bool(workers) and int(workers) > 1 and input(
+                "Unzip in separate processes instead of threads? (y/N): ").strip().lower() == 'y'
+            dedupe = input("Remove duplicate files left by resubmissions? (y/N): ").strip().lower() == 'y'
+            budget = input("Enter a memory budget in MB for low-memory mode (press Enter for none): ").strip()
             name_dict = read_name_list(csv_path)
-            log_file_path = os.path.join(target_directory, 'merge_log.txt')
-            rename_directory(target_directory, name_dict, log_file_path)
 
-            write_submission_report(target_directory)
+            # A preview is applied as a journaled run, so an interruption can be resumed or rolled back
+            transactional = submission_plan.has_unfinished_run(target_directory)
+            if input("Preview the changes first (dry run)? (y/N): ").strip().lower() == 'y':
+                process_submission_directory(target_directory, name_dict, dry_run=True)
+                if input("Apply these changes? (y/N): ").strip().lower() != 'y':
+                    raise SystemExit
+                transactional = True
+
+            # Backup, unzip, rename/merge, and report
+            memory_budget = submission_memory.MemoryBudget.from_mb(int(budget)) if budget else None
+            metrics = submission_metrics.RunMetrics(memory_budget=memory_budget)
+            log_file_path = process_submission_directory(target_directory, name_dict, strategy=strategy or 'auto',
+                                                         workers=int(workers) if workers else 1, dedupe=dedupe,
+                                                         transactional=transactional, metrics=metrics,
+                                                         memory_budget=memory_budget, use_processes=use_processes)
 
+            metrics.print_summary()
             print(f"\n✅ Merge log saved to: {log_file_path}")
@@ -1,18 +1,12 @@
-import csv
 import os
 import zipfile
 import re
 
+import submission_roster
+
 def read_name_list(csv_path):
-    # Create a dictionary to hold the data from the CSV
-    student_dict = {}
-    # Open and read the CSV file
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            # KEY BY NAME (2nd column). Store student_id, class, team as value.
-            student_dict[row['name']] = [row['student_id'], row['class'], row['team']]
-    return student_dict
+    # KEY BY NAME (2nd column), as written. Store student_id, class, team as value.
+    return submission_roster.load_roster(csv_path).raw_name_dict()
 
 def rename_directory(target_directory, name_dict):
     # Iterate through all the directories in the target directory
@@ -1,19 +1,15 @@
-import csv
 import os
-import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import submission_roster
+import submission_unzip
+from submission_guard import ExtractionGuard, LimitExceeded
+
 def read_name_list(csv_path):
-    # Create a dictionary to hold the data from the CSV
-    student_dict = {}
-    # Open and read the CSV file
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            # Store name, class, and team as a list associated with student_id
-            student_dict[row['student_id']] = [row['name'], row['class'], row['team']]
-    return student_dict
+    # Store name, class, and team as a list associated with student_id
+    return submission_roster.load_roster(csv_path).id_dict()
 
 def rename_directory(target_directory, name_dict):
     # Iterate through all the directories in the target directory
@@ -29,27 +25,44 @@ def rename_directory(target_directory, name_dict):
                 os.rename(item_path, new_path)
                 print(f"Renamed '{item}' to '{new_name}'")
 
-def unzip_files_in_subdirectories(directory):
+def unzip_folder(item_path, guard):
+    # Extract every ZIP directly inside one student folder.
+    # Messages and errors are returned rather than printed so folders can run in parallel.
+    # Archives over the guard's limits are quarantined instead of extracted.
+    messages = []
+    errors = []
+    for filename in os.listdir(item_path):
+        if filename.endswith('.zip'):
+            zip_path = os.path.join(item_path, filename)
+            try:
+                # Stream the members out and restore file and folder timestamps
+                submission_unzip.extract_zip_file(zip_path, guard)
+                messages.append(f"Unzipped {filename} in {item_path}")
+            except LimitExceeded as e:
+                quarantine_path = guard.quarantine(zip_path, e)
+                messages.append(f"Quarantined {filename} - {e} (moved to {quarantine_path})")
+                errors.append((zip_path, f"quarantined: {e}"))
+            except zipfile.BadZipFile:
+                messages.append(f"Failed to unzip {filename} - not a zip file or corrupted.")
+                errors.append((zip_path, "not a zip file or corrupted"))
+    return messages, errors
+
+def unzip_files_in_subdirectories(directory, workers=1):
     # Change the working directory to the specified directory
     os.chdir(directory)
-    # Iterate over the items in the directory
-    for item in os.listdir():
-        item_path = os.path.join(directory, item)
-        if os.path.isdir(item_path):
-            for filename in os.listdir(item_path):
-                if filename.endswith('.zip'):
-                    zip_path = os.path.join(item_path, filename)
-                    try:
-                        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                            for zip_info in zip_ref.infolist():
-                                extracted_path = zip_ref.extract(zip_info, path=item_path)
-                                # Get the original modification time from the ZIP info
-                                date_time = time.mktime(zip_info.date_time + (0, 0, -1))
-                                # Set the extracted file's modification time to the original time
-                                os.utime(extracted_path, (date_time, date_time))
-                        print(f"Unzipped {filename} in {item_path}")
-                    except zipfile.BadZipFile:
-                        print(f"Failed to unzip {filename} - not a zip file or corrupted.")
+    # Collect the student folders; each one is an independent unit of work
+    folders = [os.path.join(directory, item) for item in os.listdir()
+               if os.path.isdir(os.path.join(directory, item))]
+    guard = ExtractionGuard(directory)
+    errors = []
+    # A bounded pool extracts several folders at once; workers=1 keeps the serial path
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for messages, folder_errors in executor.map(unzip_folder, folders, [guard] * len(folders)):
+            # Results come back in folder order, so the output matches a serial run
+            for message in messages:
+                print(message)
+            errors.extend(folder_errors)
+    return errors
 
 if __name__ == "__main__":
     target_directory = input("Enter the dir. containing student submission: ")
@@ -62,4 +75,5 @@ if __name__ == "__main__":
         else:
             name_dict = read_name_list(csv_path)
             rename_directory(target_directory, name_dict)
-            unzip_files_in_subdirectories(target_directory)
\ No newline at end of file
+            workers = input("Enter the number of parallel unzip workers (press Enter for 1): ")
+            unzip_files_in_subdirectories(target_directory, int(workers) if workers.strip() else 1)
\ No newline at end of file
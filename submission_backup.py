@@ -0,0 +1,116 @@
+import errno
+import hashlib
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Backup strategies for the original ZIP files.
+#   'hardlink' - a second name for the same file; needs the same filesystem
+#   'reflink'  - a copy-on-write clone (btrfs, XFS, APFS-style filesystems),
+#                falling back to an in-kernel copy_file_range where available
+#   'copy'     - a plain byte-for-byte copy with shutil.copy2
+#   'auto'     - tries hardlink, then reflink, then copy
+# A hardlinked backup stays intact because the unzip engine never writes into
+# an existing file: it writes a new one and renames it over the old name
+# (see submission_unzip.write_member).
+BACKUP_STRATEGIES = ('auto', 'hardlink', 'reflink', 'copy')
+
+# Content hashes of the files already in a backup folder are kept here
+HASH_INDEX_NAME = '.backup_hashes'
+
+# ioctl request number for FICLONE on Linux
+FICLONE = 0x40049409
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Returns the SHA-256 hex digest of a file, read in chunks
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Loads the hash -> file name index for a backup folder.
+# Backups from older runs that are missing from the index are hashed once and added.
+def load_hash_index(backup_dir):
+    index = {}
+    index_path = os.path.join(backup_dir, HASH_INDEX_NAME)
+    if os.path.isfile(index_path):
+        with open(index_path, encoding='utf-8') as f:
+            for line in f:
+                digest, _, name = line.rstrip('\n').partition('\t')
+                if name and os.path.isfile(os.path.join(backup_dir, name)):
+                    index[digest] = name
+
+    indexed_names = set(index.values())
+    for entry in os.scandir(backup_dir):
+        if entry.is_file() and entry.name != HASH_INDEX_NAME and entry.name not in indexed_names:
+            index[file_sha256(entry.path)] = entry.name
+    save_hash_index(backup_dir, index)
+    return index
+
+
+def save_hash_index(backup_dir, index):
+    index_path = os.path.join(backup_dir, HASH_INDEX_NAME)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        for digest, name in index.items():
+            f.write(f"{digest}\t{name}\n")
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+# Clones src into dst with FICLONE, or copy_file_range if cloning is not supported
+def _reflink(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            if fcntl is None:
+                raise OSError(errno.EOPNOTSUPP, "reflink not available on this platform")
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            if not hasattr(os, 'copy_file_range'):
+                raise
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+    shutil.copystat(src, dst)
+
+
+def _copy(src, dst):
+    shutil.copy2(src, dst)
+
+
+STRATEGY_FUNCTIONS = {
+    'hardlink': _hardlink,
+    'reflink': _reflink,
+    'copy': _copy,
+}
+
+
+# Backs up one file with the requested strategy and returns the strategy used.
+# 'auto' falls through hardlink and reflink to a plain copy; an explicit
+# strategy that fails raises the OSError.
+def backup_file(src, dst, strategy='auto'):
+    if strategy not in BACKUP_STRATEGIES:
+        raise ValueError(f"Unknown backup strategy '{strategy}', expected one of {BACKUP_STRATEGIES}")
+    candidates = ('hardlink', 'reflink', 'copy') if strategy == 'auto' else (strategy,)
+    for name in candidates:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            STRATEGY_FUNCTIONS[name](src, dst)
+            return name
+        except OSError:
+            if name == candidates[-1]:
+                raise
@@ -0,0 +1,144 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from submission_backup import file_sha256
+
+# Content-addressed duplicate detection, run once the student folders are in place.
+#
+# Files are grouped by size first; only sizes shared by two or more files are
+# hashed (chunked SHA-256 on a thread pool). Then, for every group of
+# byte-identical files:
+#   - the _1, _2... copies a merge of resubmissions left next to a file
+#     ("main.py", "main_1.py" in the same directory) are collapsed to one file.
+#     Only files the manifest records as renamed by a merge are removed, and
+#     only while the file they were renamed from is next to them with the same
+#     content: a student's own lab_1.py and lab_2.py, or identical files
+#     elsewhere in the folder (package __init__.py files, licences...), are kept.
+#   - copies in different student folders are reported, and can optionally be
+#     replaced by hardlinks to one shared copy to save space. A later extraction
+#     into a linked path replaces the file rather than writing into it (see
+#     submission_unzip.write_member), so the other students' copies are untouched.
+DUPLICATE_REPORT_NAME = 'duplicate_report.txt'
+
+# Merge suffixes such as "main_1.py"; files without one are kept in preference
+MERGE_SUFFIX_RE = re.compile(r'_\d+$')
+
+
+# Lists every regular file under the top-level folders, except those in `skip`,
+# as (folder, path, size)
+def collect_files(directory, skip=()):
+    files = []
+    with os.scandir(directory) as top:
+        folders = [entry for entry in top if entry.is_dir(follow_symlinks=False) and entry.name not in skip]
+    for folder in folders:
+        stack = [folder.path]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append((folder.name, entry.path, entry.stat(follow_symlinks=False).st_size))
+    return files
+
+
+# Returns {sha256: [(folder, path, size), ...]} for every content seen more than once
+def find_duplicates(directory, workers=8, min_size=1, skip=()):
+    by_size = {}
+    for folder, path, size in collect_files(directory, skip):
+        if size >= min_size:
+            by_size.setdefault(size, []).append((folder, path, size))
+    candidates = [item for group in by_size.values() if len(group) > 1 for item in group]
+
+    by_hash = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item, digest in zip(candidates, executor.map(lambda item: file_sha256(item[1]), candidates)):
+            by_hash.setdefault(digest, []).append(item)
+    return {digest: group for digest, group in by_hash.items() if len(group) > 1}
+
+
+# The path a merge copy ("main_1.py") was renamed from ("main.py")
+def merge_original(path):
+    directory, filename = os.path.split(path)
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(directory, MERGE_SUFFIX_RE.sub('', stem) + ext)
+
+
+# The copy that survives: no merge suffix, then the shortest, then the first by path
+def keeper_sort_key(item):
+    stem = os.path.splitext(os.path.basename(item[1]))[0]
+    return (bool(MERGE_SUFFIX_RE.search(stem)), len(item[1]), item[1])
+
+
+# Replaces `path` with a hardlink to `target`, unless it already is one.
+# A linked file takes the target's timestamps, so copies with a different
+# mtime are left alone to keep late-submission evidence intact.
+def link_to(target, path):
+    target_stat, path_stat = os.stat(target), os.stat(path)
+    if os.path.samestat(target_stat, path_stat) or target_stat.st_mtime_ns != path_stat.st_mtime_ns:
+        return False
+    tmp_path = path + '.dedupe_tmp'
+    os.link(target, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+# Collapses merge copies within each student (only with a manifest, which
+# records them), optionally hardlinks identical files across students, and
+# writes a report of the cross-student matches. With a manifest, re-downloaded
+# copies of folders an earlier run renamed are not looked at (see
+# SubmissionManifest.redownloaded_folders): they would all match their renamed folder.
+# Returns (files removed, files hardlinked, bytes saved).
+def dedupe_submissions(directory, workers=8, hardlink_across_students=False, min_size=1,
+                       report_filename=DUPLICATE_REPORT_NAME, manifest=None):
+    skip = manifest.redownloaded_folders() if manifest is not None else {}
+    duplicates = find_duplicates(directory, workers, min_size, skip)
+    removed = linked = saved = 0
+    report_path = os.path.join(directory, report_filename)
+
+    with open(report_path, 'w', encoding='utf-8') as rpt:
+        for digest, group in sorted(duplicates.items(), key=lambda kv: kv[1][0][2], reverse=True):
+            by_folder = {}
+            for item in group:
+                by_folder.setdefault(item[0], []).append(item)
+
+            keepers = []
+            for folder, items in sorted(by_folder.items()):
+                items.sort(key=keeper_sort_key)
+                paths = {item[1] for item in items}
+                kept = []
+                for item in items:
+                    folder_name, path, size = item
+                    original = merge_original(path)
+                    if manifest is None or not manifest.is_merge_copy(path) or original not in paths:
+                        kept.append(item)
+                        continue
+                    os.remove(path)
+                    removed += 1
+                    saved += size
+                    print(f"🧹 Removed duplicate {path} (same as {original})")
+                    manifest.forget_merge_copy(path)
+                    manifest.mark_dirty(path)
+                keepers.append(kept[0])
+
+            if len(keepers) < 2:
+                continue
+            size = keepers[0][2]
+            rpt.write(f"{digest} ({size} bytes) in {len(keepers)} folders\n")
+            for folder, path, _ in keepers:
+                rpt.write(f"  {os.path.relpath(path, directory)}\n")
+            rpt.write("\n")
+
+            if hardlink_across_students:
+                for folder, path, _ in keepers[1:]:
+                    try:
+                        if link_to(keepers[0][1], path):
+                            linked += 1
+                            saved += size
+                    except OSError as e:
+                        print(f"Failed to hardlink {path} - {e}")
+        rpt.write("End of Report\n")
+
+    print(f"📄 Duplicate report saved to: {report_path}")
+    return removed, linked, saved
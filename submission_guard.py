@@ -0,0 +1,190 @@
+import os
+import shutil
+import threading
+import zipfile
+from datetime import datetime
+
+# Limits on what the unzip engine is willing to extract.
+#
+# Before an archive is extracted its central directory is checked (no data is
+# decompressed) against per-archive and per-student limits:
+#   - total uncompressed bytes and number of members
+#   - compression ratio of each large member (zip bombs)
+#   - nesting depth (ZIP in ZIP in ZIP...)
+# Per-student totals add up everything extracted for one top-level student
+# folder, nested archives included, so a recursive bomb is stopped once the
+# student's budget is used up. An archive over a limit is not extracted at all
+# and is moved to ../__quarantine with the reason in quarantine_log.txt.
+#
+# A ZIP lying directly in the submission directory may be a whole cohort (an
+# LMS bulk download), far over the per-archive limits. At depth 0 it is only
+# held to the per-student limits, each member counting towards the top-level
+# folder it extracts into, plus the ratio check on every member.
+#
+# The declared sizes can be trusted while extracting: zipfile stops reading a
+# member at its declared size and checks its CRC.
+#
+# The member count is checked once more before the archive is even opened,
+# from its end-of-central-directory record, since opening it makes zipfile
+# load every member's entry; with a memory budget (see submission_memory)
+# archives whose entries would not fit in it are refused there too.
+QUARANTINE_DIR_NAME = '__quarantine'
+QUARANTINE_LOG_NAME = 'quarantine_log.txt'
+
+MB = 1024 * 1024
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+# Reads an archive's end-of-central-directory record with zipfile's private
+# helpers: zipfile has no public way to get the member count without loading
+# every member's entry, which is what the precheck is there to avoid. This is
+# the only place the module relies on zipfile internals (_EndRecData and the
+# _ECD_* field indexes). Should a Python release drop them, the precheck is
+# skipped and the limits are still checked once the archive is open.
+def read_end_record(f):
+    try:
+        end_rec_data = zipfile._EndRecData
+        entries_field, size_field = zipfile._ECD_ENTRIES_TOTAL, zipfile._ECD_SIZE
+    except AttributeError:
+        return None
+    end_record = end_rec_data(f)
+    if end_record is None:
+        return None
+    return end_record[entries_field], end_record[size_field]
+
+
+# Returns (members, central directory bytes) from an archive's end record,
+# or None if it has none (zipfile then reports the archive as corrupted) or
+# it cannot be read (see read_end_record)
+def archive_index_size(zip_path):
+    with open(zip_path, 'rb') as f:
+        return read_end_record(f)
+
+
+# The top-level folder an archive member extracts into, or '' for a member at
+# the root of the archive; names are cleaned the way extraction cleans them
+def member_top_folder(member_name):
+    parts = [part for part in member_name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return parts[0] if len(parts) > 1 else ''
+
+
+class ExtractionLimits:
+    __slots__ = ('max_archive_bytes', 'max_archive_members', 'max_student_bytes', 'max_student_members',
+                 'max_ratio', 'ratio_min_bytes', 'max_depth')
+
+    def __init__(self, max_archive_bytes=2048 * MB, max_archive_members=20000, max_student_bytes=4096 * MB,
+                 max_student_members=50000, max_ratio=100, ratio_min_bytes=MB, max_depth=4):
+        self.max_archive_bytes = max_archive_bytes
+        self.max_archive_members = max_archive_members
+        self.max_student_bytes = max_student_bytes
+        self.max_student_members = max_student_members
+        self.max_ratio = max_ratio
+        # Small members (text, blank images) can compress extremely well and are harmless
+        self.ratio_min_bytes = ratio_min_bytes
+        self.max_depth = max_depth
+
+
+# Checks archives against the limits and keeps the per-student totals for one
+# submission directory. Safe to share between the threads of a parallel unzip.
+class ExtractionGuard:
+    def __init__(self, directory, limits=None, quarantine_dir=None, memory_budget=None):
+        self.directory = os.path.abspath(directory)
+        self.limits = limits or ExtractionLimits()
+        self.memory_budget = memory_budget
+        self.quarantine_dir = quarantine_dir or os.path.join(os.path.dirname(self.directory),
+                                                             QUARANTINE_DIR_NAME)
+        self.student_totals = {}   # student folder -> [bytes, members]
+        self.lock = threading.Lock()
+
+    # Process pool workers get a copy with a fresh lock
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # The top-level folder of the submission directory an archive belongs to
+    def student_of(self, zip_path):
+        rel_path = os.path.relpath(os.path.abspath(zip_path), self.directory)
+        return rel_path.split(os.sep, 1)[0] if os.sep in rel_path else ''
+
+    # True for an archive lying directly in the submission directory, which
+    # extracts into the student folders rather than into one of them
+    def is_root_archive(self, zip_path, depth=0):
+        return depth == 0 and self.student_of(zip_path) == ''
+
+    # Raises LimitExceeded if the archive has too many members to be opened at
+    # all; called before zipfile reads its central directory
+    def precheck(self, zip_path, depth=0):
+        index_size = archive_index_size(zip_path)
+        if index_size is None:
+            return
+        members, index_bytes = index_size
+        if members > self.limits.max_archive_members and not self.is_root_archive(zip_path, depth):
+            raise LimitExceeded(f"{members} members (limit {self.limits.max_archive_members})")
+        if self.memory_budget is not None:
+            self.memory_budget.check_archive(zip_path, members, index_bytes)
+
+    # Raises LimitExceeded if extracting `members` (the archive's infolist) at
+    # this nesting depth would go over a limit; otherwise counts them for the
+    # student (for a root archive, for the student folder each member goes into)
+    def check(self, zip_path, members, depth=0):
+        limits = self.limits
+        if depth > limits.max_depth:
+            raise LimitExceeded(f"nested {depth} archives deep (limit {limits.max_depth})")
+        root_archive = self.is_root_archive(zip_path, depth)
+        if len(members) > limits.max_archive_members and not root_archive:
+            raise LimitExceeded(f"{len(members)} members (limit {limits.max_archive_members})")
+
+        total = 0
+        student = self.student_of(zip_path)
+        added = {}   # student folder -> [bytes, members]
+        for zip_info in members:
+            total += zip_info.file_size
+            ratio = zip_info.file_size / max(zip_info.compress_size, 1)
+            if zip_info.file_size >= limits.ratio_min_bytes and ratio > limits.max_ratio:
+                raise LimitExceeded(f"'{zip_info.filename}' compressed {ratio:.0f}:1 (limit {limits.max_ratio}:1)")
+            counts = added.setdefault(member_top_folder(zip_info.filename) if root_archive else student, [0, 0])
+            counts[0] += zip_info.file_size
+            counts[1] += 1
+        if total > limits.max_archive_bytes and not root_archive:
+            raise LimitExceeded(f"{total // MB} MB uncompressed (limit {limits.max_archive_bytes // MB} MB)")
+
+        with self.lock:
+            for folder, (size, count) in added.items():
+                totals = self.student_totals.get(folder, [0, 0])
+                who = f"'{folder}'" if root_archive else "student"
+                if totals[0] + size > limits.max_student_bytes:
+                    raise LimitExceeded(f"{who} total would reach {(totals[0] + size) // MB} MB "
+                                        f"(limit {limits.max_student_bytes // MB} MB)")
+                if totals[1] + count > limits.max_student_members:
+                    raise LimitExceeded(f"{who} total would reach {totals[1] + count} members "
+                                        f"(limit {limits.max_student_members})")
+            for folder, (size, count) in added.items():
+                totals = self.student_totals.setdefault(folder, [0, 0])
+                totals[0] += size
+                totals[1] += count
+
+    # Moves a rejected archive out of the submission tree and logs why.
+    # Returns its new path.
+    def quarantine(self, zip_path, reason):
+        rel_path = os.path.relpath(os.path.abspath(zip_path), self.directory)
+        with self.lock:
+            os.makedirs(self.quarantine_dir, exist_ok=True)
+            base, ext = os.path.splitext(rel_path.replace(os.sep, '_'))
+            target_path = os.path.join(self.quarantine_dir, base + ext)
+            counter = 1
+            while os.path.exists(target_path):
+                target_path = os.path.join(self.quarantine_dir, f"{base}_{counter}{ext}")
+                counter += 1
+            shutil.move(zip_path, target_path)
+            with open(os.path.join(self.quarantine_dir, QUARANTINE_LOG_NAME), 'a', encoding='utf-8') as log_file:
+                log_file.write(f"{datetime.now():%Y-%m-%d %H:%M:%S} {rel_path} → "
+                               f"{os.path.basename(target_path)}: {reason}\n")
+        return target_path
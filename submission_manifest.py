@@ -0,0 +1,198 @@
+import json
+import os
+
+from submission_backup import file_sha256
+
+# Persistent record of what earlier runs already did to a submission directory,
+# so that a late-submission batch only touches new or changed entries.
+#
+# The manifest is a JSON file kept in the target directory:
+#   archives - rel_path -> {size, mtime_ns, sha256, status} for every ZIP seen
+#   renames  - original folder name -> renamed folder name (None when skipped)
+#   originals - original folder name -> {archive rel_path: sha256} as submitted,
+#              so a re-downloaded copy of an already renamed folder is recognised
+#   merge_copies - files a merge moved under a _1, _2... name to avoid a clash;
+#              the only ones submission_dedupe may remove as duplicates
+#   reports  - folder name -> cached report block for that folder
+#   dirty    - folders changed since their report block was cached
+MANIFEST_NAME = '.submission_manifest.json'
+
+
+class SubmissionManifest:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.archives = {}
+        self.renames = {}
+        self.originals = {}
+        self.merge_copies = set()
+        self.reports = {}
+        self.dirty = set()
+        self.redownloaded = None
+        if os.path.isfile(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.archives = data.get('archives', {})
+            self.renames = data.get('renames', {})
+            self.originals = data.get('originals', {})
+            self.merge_copies = set(data.get('merge_copies', []))
+            self.reports = data.get('reports', {})
+            self.dirty = set(data.get('dirty', []))
+
+    # Writes the manifest atomically so an interrupted run never leaves it half-written
+    def save(self):
+        data = {
+            'archives': self.archives,
+            'renames': self.renames,
+            'originals': self.originals,
+            'merge_copies': sorted(self.merge_copies),
+            'reports': self.reports,
+            'dirty': sorted(self.dirty),
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _key(self, path):
+        return os.path.relpath(path, self.directory)
+
+    # Top-level folder name a path belongs to, or None for files in the directory itself
+    def top_folder(self, path):
+        rel_path = self._key(path)
+        return rel_path.split(os.sep, 1)[0] if os.sep in rel_path else None
+
+    # --- Archives ---
+
+    # True if the archive was recorded with the same size and mtime
+    def archive_unchanged(self, zip_path, status=None):
+        entry = self.archives.get(self._key(zip_path))
+        if entry is None or (status is not None and entry.get('status') != status):
+            return False
+        st = os.stat(zip_path)
+        return entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+
+    def archive_hash(self, zip_path):
+        entry = self.archives.get(self._key(zip_path))
+        return entry.get('sha256') if entry else None
+
+    def record_archive(self, zip_path, sha256=None, status='backed_up'):
+        st = os.stat(zip_path)
+        key = self._key(zip_path)
+        entry = self.archives.get(key, {})
+        entry.update({'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'status': status})
+        if sha256 is not None:
+            entry['sha256'] = sha256
+        self.archives[key] = entry
+
+    # Marks an archive as extracted; the ZIP itself is gone by then so the stat is kept
+    def mark_archive_extracted(self, zip_path):
+        entry = self.archives.setdefault(self._key(zip_path), {'size': None, 'mtime_ns': None})
+        entry['status'] = 'extracted'
+        self.mark_dirty(zip_path)
+
+    # --- Folders ---
+
+    # Marks the top-level folder containing `path` as changed
+    def mark_dirty(self, path):
+        folder = self.top_folder(path)
+        if folder:
+            self.dirty.add(folder)
+
+    # Renamed folders from earlier runs, and re-downloaded copies of the folders
+    # they came from; they no longer need a roster lookup
+    def processed_folders(self):
+        return {new_name for new_name in self.renames.values() if new_name} | set(self.redownloaded_folders())
+
+    # Original LMS folders that are back in the directory (e.g. the cohort was
+    # downloaded again) although an earlier run renamed them, and that still hold
+    # exactly the archives submitted then. They are skipped by every stage rather
+    # than extracted and merged into their renamed folder as _1 duplicates.
+    # Returns {folder: renamed folder}; worked out once, before anything is extracted.
+    def redownloaded_folders(self):
+        if self.redownloaded is None:
+            self.redownloaded = {}
+            for folder, archives in self.originals.items():
+                folder_path = os.path.join(self.directory, folder)
+                if self.renames.get(folder) and os.path.isdir(folder_path) \
+                        and self.same_archives(folder_path, archives):
+                    self.redownloaded[folder] = self.renames[folder]
+        return self.redownloaded
+
+    # True if the path lies in one of the redownloaded_folders
+    def in_redownloaded_folder(self, path):
+        return self.top_folder(path) in self.redownloaded_folders()
+
+    # True if the ZIPs under folder_path are exactly `archives` (rel_path -> sha256)
+    def same_archives(self, folder_path, archives):
+        found = {}
+        for root, _, files in os.walk(folder_path):
+            for filename in files:
+                if filename.endswith('.zip'):
+                    path = os.path.join(root, filename)
+                    found[os.path.relpath(path, folder_path)] = path
+        if found.keys() != archives.keys():
+            return False
+        return all(file_sha256(path) == archives[rel_path] for rel_path, path in found.items())
+
+    # Records a rename decision and moves the folder's archive entries along with it
+    def record_rename(self, folder_name, new_name):
+        self.renames[folder_name] = new_name
+        self.reports.pop(folder_name, None)
+        if not new_name:
+            return
+        self.dirty.add(new_name)
+        self.dirty.discard(folder_name)
+        prefix = folder_name + os.sep
+        # Archives with a hash are the ones submitted; nested ones only appear once extracted
+        self.originals[folder_name] = {key[len(prefix):]: entry['sha256'] for key, entry in self.archives.items()
+                                       if key.startswith(prefix) and entry.get('sha256')}
+        for key in [k for k in self.archives if k.startswith(prefix)]:
+            self.archives[new_name + os.sep + key[len(prefix):]] = self.archives.pop(key)
+
+    # Undoes record_rename, for a rename that was rolled back
+    def forget_rename(self, folder_name, new_name):
+        self.renames.pop(folder_name, None)
+        self.originals.pop(folder_name, None)
+        if not new_name:
+            return
+        self.dirty.add(folder_name)
+        prefix = new_name + os.sep
+        for key in [k for k in self.archives if k.startswith(prefix)]:
+            self.archives[folder_name + os.sep + key[len(prefix):]] = self.archives.pop(key)
+
+    # --- Merge copies ---
+
+    def record_merge_copies(self, paths):
+        self.merge_copies.update(self._key(path) for path in paths)
+
+    def forget_merge_copy(self, path):
+        self.merge_copies.discard(self._key(path))
+
+    def is_merge_copy(self, path):
+        return self._key(path) in self.merge_copies
+
+    # --- Report ---
+
+    # Returns the cached block if the folder is unchanged since it was written.
+    # The folder's own mtime catches files dropped in by hand between runs.
+    def cached_report_block(self, folder_name, mtime_ns):
+        entry = self.reports.get(folder_name)
+        if folder_name in self.dirty or entry is None or entry['mtime_ns'] != mtime_ns:
+            return None
+        return entry['block']
+
+    def store_report_block(self, folder_name, block, mtime_ns):
+        self.reports[folder_name] = {'mtime_ns': mtime_ns, 'block': block}
+        self.dirty.discard(folder_name)
+
+    # Drops cached report blocks for folders that no longer exist
+    def prune_reports(self, folder_names):
+        for folder_name in list(self.reports):
+            if folder_name not in folder_names:
+                del self.reports[folder_name]
+
+    # Drops every cached report block; they hold a copy of the whole text report,
+    # which the low-memory mode does not keep around
+    def clear_reports(self):
+        self.reports = {}
@@ -0,0 +1,88 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from submission_guard import MB, LimitExceeded
+
+# Peak-memory budget for the low-memory mode of the pipeline.
+#
+# Python's zipfile reads an archive's whole central directory into ZipInfo
+# objects as soon as the archive is opened, about half a kilobyte per member,
+# so an archive with hundreds of thousands of members costs hundreds of MB
+# before a byte is extracted. The budget estimates that cost from the
+# end-of-central-directory record (a few hundred bytes at the end of the file)
+# and refuses archives whose index would not fit; the guard (see
+# submission_guard) quarantines them like any other archive over a limit.
+# What the process actually used is read back at the end of the run as its
+# peak resident set size.
+
+# Measured cost of one member once zipfile has parsed it, on top of the
+# central directory entry itself
+ZIPINFO_BYTES = 512
+
+
+# Bytes currently resident, or None where this cannot be read
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+# Highest resident set size of this process so far, or None where unknown.
+# On Linux this is VmHWM: ru_maxrss also counts what the process held before
+# it exec'ed, i.e. the RSS of the parent it was forked from.
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Starts the peak over from what is resident now, so that a later peak_rss is
+# the peak of what follows rather than of, e.g., importing a test runner.
+# Only Linux allows this (/proc/self/clear_refs); returns False elsewhere.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        # What the process already holds (interpreter, roster...) when the run starts
+        self.baseline_bytes = current_rss() or 0
+
+    @classmethod
+    def from_mb(cls, limit_mb):
+        return cls(limit_mb * MB)
+
+    # Raises LimitExceeded if opening the archive would not fit in the budget
+    def check_archive(self, zip_path, members, index_bytes):
+        needed = members * ZIPINFO_BYTES + index_bytes
+        available = self.limit_bytes - self.baseline_bytes
+        if needed > available:
+            raise LimitExceeded(f"its {members} member index needs about {needed // MB} MB "
+                                f"({available // MB} MB left in the {self.limit_bytes // MB} MB memory budget)")
+
+    def summary(self):
+        peak = peak_rss()
+        return {'budget_bytes': self.limit_bytes, 'baseline_bytes': self.baseline_bytes,
+                'peak_rss_bytes': peak, 'over_budget': peak is not None and peak > self.limit_bytes}
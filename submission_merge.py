@@ -0,0 +1,108 @@
+import errno
+import os
+import shutil
+import sys
+
+# Merging one submission folder into another, shared by the rename scripts
+# (merge_folder_contents) and the journaled plan (submission_plan.plan_merge),
+# so that a planned merge is exactly the merge that is then carried out.
+#
+# Items are taken in name order. A folder that is in both is merged
+# recursively; anything else whose name is already taken in the destination
+# is moved under the first free "<name>_1<ext>", "<name>_2<ext>"... name.
+# Names are compared case-insensitively where the filesystem usually is.
+
+# Windows and macOS filesystems treat names differing only in case as the same file
+CASE_INSENSITIVE_FS = sys.platform in ('win32', 'darwin')
+
+
+# Key used to compare file names; case-insensitive where the filesystem usually is
+def name_key(name):
+    return name.casefold() if CASE_INSENSITIVE_FS else name
+
+
+# Moves a file or folder with a plain rename, copying only across filesystems
+def move_path(src_path, dst_path):
+    try:
+        os.rename(src_path, dst_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src_path, dst_path)
+
+
+# {name: is_dir} for a folder on disk
+def disk_listing(path):
+    with os.scandir(path) as it:
+        return {entry.name: entry.is_dir() for entry in it}
+
+
+# Yields the steps of merging src_folder into dst_folder as (kind, src_path, dst_path):
+#   'merge'       a folder in both; the steps merging it follow
+#   'rmdir'       that folder, empty once they are done (dst_path is None)
+#   'move_folder' a folder moved across under its own name
+#   'move_file'   a file, or a folder clashing with a file, moved to dst_path
+# `listing(path)` returns {name: is_dir}. Each step must be carried out before
+# the next one is asked for, since nested folders are listed as they are reached.
+def merge_steps(src_folder, dst_folder, listing):
+    # The destination is listed once; conflicts are resolved against these
+    # entries and each name taken by the merge is added to them
+    dst_entries = {name_key(name): (name, is_dir) for name, is_dir in listing(dst_folder).items()}
+
+    for item, is_dir in sorted(listing(src_folder).items()):
+        src_path = os.path.join(src_folder, item)
+        existing = dst_entries.get(name_key(item))
+        if is_dir and existing is not None and existing[1]:
+            # Merged into the folder as it is spelt in the destination
+            dst_path = os.path.join(dst_folder, existing[0])
+            yield 'merge', src_path, dst_path
+            yield from merge_steps(src_path, dst_path, listing)
+            yield 'rmdir', src_path, None
+            continue
+        if is_dir and existing is None:
+            dst_path = os.path.join(dst_folder, item)
+            yield 'move_folder', src_path, dst_path
+            dst_entries[name_key(item)] = (item, True)
+            continue
+
+        base, ext = os.path.splitext(item)
+        name = item
+        counter = 1
+        while name_key(name) in dst_entries:
+            name = f"{base}_{counter}{ext}"
+            counter += 1
+        yield 'move_file', src_path, os.path.join(dst_folder, name)
+        dst_entries[name_key(name)] = (name, is_dir)
+
+
+# Text written to the merge log for a step
+def step_log(kind, src_path, dst_path):
+    if kind == 'merge':
+        return f"  Recursively merging folder: {src_path} → {dst_path}\n"
+    if kind == 'move_folder':
+        return f"  Moved folder: {src_path} → {dst_path}\n"
+    if kind == 'move_file':
+        return f"  Moved file: {src_path} → {dst_path}\n"
+    return None
+
+
+# True for a 'move_file' step that gives the item a new (_1, _2...) name
+def is_renamed_copy(kind, src_path, dst_path):
+    return kind == 'move_file' and os.path.basename(src_path) != os.path.basename(dst_path)
+
+
+# Merges the contents of src_folder into dst_folder on disk, logging each step.
+# Items are moved with os.rename (same filesystem); src_folder is left empty.
+# Returns the new paths of the items that were renamed to avoid a clash.
+def merge_folder_contents(src_folder, dst_folder, log_file):
+    renamed = []
+    for kind, src_path, dst_path in merge_steps(src_folder, dst_folder, disk_listing):
+        if kind == 'rmdir':
+            os.rmdir(src_path)
+            continue
+        if kind != 'merge':
+            move_path(src_path, dst_path)
+        if is_renamed_copy(kind, src_path, dst_path):
+            renamed.append(dst_path)
+        log_file.write(step_log(kind, src_path, dst_path))
+    return renamed
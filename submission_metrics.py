@@ -0,0 +1,155 @@
+import cProfile
+import heapq
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import submission_memory
+
+# Instrumentation for the pipeline stages (backup, unzip, rename, report...).
+#
+# A RunMetrics object is passed down through the stage functions. It
+#   - times each stage (`with metrics.stage('unzip'):`)
+#   - adds up per-stage counters such as files, bytes, archives or folders
+#   - keeps the slowest archives seen by the unzip engine
+#   - routes the per-item messages the scripts used to print: with quiet=True
+#     they are only counted, which saves a lot of console time on big batches
+#   - redraws a one-line progress display at most every progress_interval
+#     seconds, on stderr and only if it is a terminal
+# At the end, summary() / write() give everything as JSON, including the
+# process's peak memory and, if one was set, the memory budget it had.
+METRICS_NAME = 'pipeline_metrics.json'
+
+
+class RunMetrics:
+    def __init__(self, quiet=False, progress_interval=0.5, slowest_count=10, stream=None, memory_budget=None):
+        self.quiet = quiet
+        self.memory_budget = memory_budget
+        self.stream = stream if stream is not None else sys.stderr
+        # None turns the progress display off, as does a stream that is not a terminal
+        if progress_interval is not None and not self.stream.isatty():
+            progress_interval = None
+        self.progress_interval = progress_interval
+        self.slowest_count = slowest_count
+        self.stages = {}
+        self.slowest = []          # Min-heap of (seconds, path, size, files)
+        self.messages = 0
+        self.started = time.time()
+        self.current = None
+        self.stage_started = 0.0
+        self.last_progress = 0.0
+
+    def stage_entry(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'counts': {}}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        entry = self.stage_entry(name)
+        previous, self.current = self.current, name
+        self.stage_started = start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] += time.perf_counter() - start
+            self.current = previous
+            if self.progress_interval is not None:
+                self.stream.write('\r\033[K')
+                self.stream.flush()
+
+    # Adds to the counters of a stage, e.g. add('backup', files=1, bytes=size)
+    def add(self, name, **counts):
+        totals = self.stage_entry(name)['counts']
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+        if self.progress_interval is not None:
+            now = time.perf_counter()
+            if now - self.last_progress >= self.progress_interval:
+                self.last_progress = now
+                self.show_progress(name, totals, now)
+
+    def show_progress(self, name, totals, now):
+        parts = [f"{value / 1e6:.1f} MB" if key == 'bytes' else f"{value} {key}"
+                 for key, value in totals.items()]
+        elapsed = now - self.stage_started if name == self.current else 0.0
+        self.stream.write(f"\r\033[K[{name}] {', '.join(parts)} ({elapsed:.1f}s)")
+        self.stream.flush()
+
+    # Called by the unzip engine for every archive it extracts
+    def record_archive(self, path, seconds, size, files, name='unzip'):
+        self.add(name, archives=1, files=files, bytes=size)
+        item = (seconds, path, size, files)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, item)
+        elif item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+
+    # Replaces the per-item print calls of the stage functions
+    def log(self, message):
+        self.messages += 1
+        if not self.quiet:
+            if self.progress_interval is not None:
+                self.stream.write('\r\033[K')
+            print(message)
+
+    def summary(self):
+        stages = {}
+        for name, entry in self.stages.items():
+            seconds = entry['seconds']
+            stage = {'seconds': round(seconds, 6), **entry['counts']}
+            for key in ('files', 'bytes'):
+                if key in entry['counts'] and seconds:
+                    stage[f"{key}_per_second"] = round(entry['counts'][key] / seconds, 1)
+            stages[name] = stage
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall_seconds': round(time.time() - self.started, 3),
+            'messages': self.messages,
+            'stages': stages,
+            'slowest_archives': [{'path': path, 'seconds': round(seconds, 6), 'bytes': size, 'files': files}
+                                 for seconds, path, size, files in sorted(self.slowest, reverse=True)],
+            'memory': (self.memory_budget.summary() if self.memory_budget is not None
+                       else {'peak_rss_bytes': submission_memory.peak_rss()}),
+        }
+
+    def write(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def print_summary(self):
+        for name, stage in self.summary()['stages'].items():
+            counts = ', '.join(f"{stage[key] / 1e6:.1f} MB" if key == 'bytes' else f"{stage[key]} {key}"
+                               for key in self.stages[name]['counts'])
+            # Stages that only count (e.g. inside a streamed run) have no time of their own
+            parts = [f"{stage['seconds']:.2f}s"] if self.stages[name]['seconds'] else []
+            if counts:
+                parts.append(f"({counts})" if parts else counts)
+            print(f"⏱️ {name}: {' '.join(parts)}")
+        memory = self.summary()['memory']
+        if memory['peak_rss_bytes'] is not None:
+            # In the MB the budget is given in
+            mb = submission_memory.MB
+            budget = f" (budget {memory['budget_bytes'] // mb} MB)" if 'budget_bytes' in memory else ""
+            warning = " ⚠️ over budget" if memory.get('over_budget') else ""
+            print(f"🧠 peak memory: {memory['peak_rss_bytes'] / mb:.0f} MB{budget}{warning}")
+
+
+# Runs the enclosed code under cProfile and saves the stats to `path`
+# (view them with `python -m pstats path`). Does nothing if path is None.
+@contextmanager
+def profiled(path):
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
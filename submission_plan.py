@@ -0,0 +1,413 @@
+import json
+import os
+import shutil
+import zipfile
+
+import submission_merge
+import submission_unzip
+from submission_guard import LimitExceeded
+
+# Plan/execute split for the destructive steps of the pipeline (unzip, rename, merge).
+#
+# Each phase is first computed as a list of operations, which can be printed as
+# a dry run, and is then applied with a journal:
+#   .submission_plan.<phase>.json      the operations of the phase
+#   .submission_journal.<phase>.jsonl  one line per completed operation
+#   .submission_trash/                 extracted ZIPs and the files they overwrote,
+#                                      kept until the run commits
+# An interrupted run can then be resumed (completed operations are skipped) or
+# rolled back (completed operations are undone in reverse order). Once every
+# phase is applied the run is committed and these files are removed.
+#
+# Operations are plain dicts:
+#   {'op': 'extract', 'path'}               unzip an archive and any nested ones
+#   {'op': 'rename', 'src', 'dst'}          rename a student folder
+#   {'op': 'move', 'src', 'dst'}            move a file/folder while merging
+#   {'op': 'rmdir', 'path'}                 remove a folder emptied by a merge
+#   {'op': 'log'}                           only writes to the log / console
+# Any op may carry 'message' (printed), 'log' (merge log text) and 'record'
+# ([folder, new_name] rename decision for the manifest). A move that gives a
+# file a _1, _2... name carries 'merge_copy', recorded in the manifest too.
+PHASES = ('extract', 'rename')
+PLAN_NAME = '.submission_plan.{}.json'
+JOURNAL_NAME = '.submission_journal.{}.jsonl'
+TRASH_NAME = '.submission_trash'
+
+
+def plan_path(directory, phase):
+    return os.path.join(directory, PLAN_NAME.format(phase))
+
+
+def journal_path(directory, phase):
+    return os.path.join(directory, JOURNAL_NAME.format(phase))
+
+
+# True if an earlier run left a plan behind that was never committed
+def has_unfinished_run(directory):
+    return any(os.path.exists(plan_path(directory, phase)) for phase in PHASES)
+
+
+# --- Planning ---
+
+# In-memory view of the tree used while planning, so that later operations see
+# the effect of earlier ones (e.g. a second resubmission merging into a folder
+# that an earlier rename just created) without touching the disk.
+# `predicted` adds entries expected from archives that are not extracted yet.
+class TreeView:
+    def __init__(self, predicted=None):
+        self.listings = {}
+        self.aliases = {}          # planned path of a moved folder -> its path on disk
+        self.predicted = predicted or {}
+
+    def real_path(self, path):
+        head, tail = path, []
+        while head not in self.aliases:
+            parent, name = os.path.split(head)
+            if not name or parent == head:
+                return path
+            tail.append(name)
+            head = parent
+        return os.path.join(self.aliases[head], *reversed(tail))
+
+    # {name: is_dir} for a directory as it will look at this point of the plan
+    def listing(self, path):
+        if path not in self.listings:
+            real = self.real_path(path)
+            entries = {}
+            if os.path.isdir(real):
+                with os.scandir(real) as it:
+                    for entry in it:
+                        entries[entry.name] = entry.is_dir()
+            for name, is_dir in self.predicted.get(real, {}).items():
+                if is_dir is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = is_dir
+            self.listings[path] = entries
+        return self.listings[path]
+
+    def move(self, src, dst):
+        is_dir = self.listing(os.path.dirname(src)).pop(os.path.basename(src))
+        self.listing(os.path.dirname(dst))[os.path.basename(dst)] = is_dir
+        if is_dir:
+            self.aliases[dst] = self.real_path(src)
+            prefix = src + os.sep
+            for path in [p for p in self.listings if p == src or p.startswith(prefix)]:
+                self.listings[dst + path[len(src):]] = self.listings.pop(path)
+
+    def remove(self, path):
+        self.listing(os.path.dirname(path)).pop(os.path.basename(path), None)
+
+
+# Predicts what extracting the given archives adds to the tree, from their
+# central directories. Nested archives are only expanded when applied.
+def predict_extraction(zip_paths):
+    predicted = {}
+    for zip_path in zip_paths:
+        root, filename = os.path.split(zip_path)
+        try:
+            with zipfile.ZipFile(zip_path) as zip_ref:
+                names = zip_ref.namelist()
+        except (zipfile.BadZipFile, OSError):
+            continue
+        predicted.setdefault(root, {})[filename] = None
+        for name in names:
+            target = submission_unzip.member_target_path(name, root)
+            is_dir = name.endswith('/')
+            while target != root and os.path.dirname(target) != target:
+                parent = os.path.dirname(target)
+                predicted.setdefault(parent, {})[os.path.basename(target)] = is_dir
+                target, is_dir = parent, True
+    return predicted
+
+
+def plan_extractions(zip_paths):
+    return [{'op': 'extract', 'path': zip_path} for zip_path in sorted(zip_paths)]
+
+
+# Plans a merge with the same steps merge_folder_contents carries out
+def plan_merge(view, src_folder, dst_folder, ops):
+    for kind, src_path, dst_path in submission_merge.merge_steps(src_folder, dst_folder, view.listing):
+        if kind == 'merge':
+            ops.append({'op': 'log', 'log': submission_merge.step_log(kind, src_path, dst_path)})
+        elif kind == 'rmdir':
+            ops.append({'op': 'rmdir', 'path': src_path})
+            view.remove(src_path)
+        else:
+            op = {'op': 'move', 'src': src_path, 'dst': dst_path,
+                  'log': submission_merge.step_log(kind, src_path, dst_path)}
+            if submission_merge.is_renamed_copy(kind, src_path, dst_path):
+                op['merge_copy'] = True
+            ops.append(op)
+            view.move(src_path, dst_path)
+
+
+# Plans the rename/merge of every student folder, as rename_directory does it.
+# `resolve(item)` returns (new_name or None, message, log text) for a folder name.
+def plan_renames(target_directory, resolve, view=None, skip=()):
+    view = view or TreeView()
+    ops = []
+    for item, is_dir in sorted(view.listing(target_directory).items()):
+        if not is_dir or item in skip:
+            continue
+        new_name, message, log_text = resolve(item)
+        if message or log_text:
+            ops.append({'op': 'log', 'message': message, 'log': log_text})
+        if new_name is None:
+            ops.append({'op': 'log', 'record': [item, None]})
+            continue
+        if new_name == item:
+            continue
+
+        item_path = os.path.join(target_directory, item)
+        new_path = os.path.join(target_directory, new_name)
+        if new_name in view.listing(target_directory):
+            ops.append({'op': 'log', 'log': f"\nMERGE: '{item}' → existing '{new_name}'\n"})
+            plan_merge(view, item_path, new_path, ops)
+            ops.append({'op': 'rmdir', 'path': item_path, 'message': f"Merged and removed folder '{item}'",
+                        'record': [item, new_name]})
+            view.remove(item_path)
+        else:
+            ops.append({'op': 'rename', 'src': item_path, 'dst': new_path,
+                        'message': f"Renamed '{item}' to '{new_name}'", 'record': [item, new_name]})
+            view.move(item_path, new_path)
+    return ops
+
+
+# Human-readable form of an operation for dry runs
+def describe(op):
+    kind = op['op']
+    if kind == 'extract':
+        return f"extract {op['path']}"
+    if kind in ('rename', 'move'):
+        return f"{kind} {op['src']} → {op['dst']}"
+    if kind == 'rmdir':
+        return f"rmdir {op['path']}"
+    return op.get('message') or (op.get('log') or '').strip()
+
+
+def print_plan(ops):
+    for op in ops:
+        text = describe(op)
+        if text:
+            print(f"[DRY RUN] {text}")
+
+
+# --- Applying ---
+
+# Moves the files an extraction is about to overwrite into the trash, so that a
+# rollback can put them back. The targets and where each existing file goes are
+# journaled before anything is moved or written: a rollback then removes every
+# target the archive may have written, even if extraction stopped part-way.
+def save_targets(trash_dir, name, zip_path, targets, journal):
+    targets = list(dict.fromkeys(targets))
+    saved = {}
+    for target in targets:
+        if target != zip_path and os.path.lexists(target) and not os.path.isdir(target):
+            saved[target] = os.path.join(trash_dir, name, f"{len(saved)}_{os.path.basename(target)}")
+    entry = {'extracting': zip_path, 'targets': targets, 'saved': saved}
+    journal(entry)
+    if saved:
+        os.makedirs(os.path.join(trash_dir, name), exist_ok=True)
+    for target, trash_path in saved.items():
+        os.replace(target, trash_path)
+    return entry
+
+
+# Puts back the files save_targets moved to the trash. With remove_written, the
+# files the archive wrote are removed first (a rollback); otherwise only the
+# files it never got to overwrite are put back (a failed extraction).
+def restore_targets(entry, remove_written=True):
+    saved = entry['saved']
+    stop = os.path.dirname(entry['extracting'])
+    for target in entry['targets']:
+        part_path = target + submission_unzip.PART_SUFFIX
+        if os.path.lexists(part_path):
+            os.remove(part_path)
+        trash_path = saved.get(target)
+        moved = trash_path is not None and os.path.lexists(trash_path)
+        if remove_written and os.path.lexists(target) and not os.path.isdir(target) \
+                and (trash_path is None or moved):
+            os.remove(target)
+            if not moved:
+                remove_empty_parents(os.path.dirname(target), stop)
+        if moved and not os.path.lexists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(trash_path, target)
+            print(f"Restored {target}")
+
+
+# Extracts an archive and its nested archives, moving each ZIP to the trash
+# instead of deleting it so that the step can be undone. Files the archive
+# overwrites are moved to the trash first (see save_targets). Archives the
+# journal already shows as extracted (an interrupted op being resumed) are not
+# redone, and one that was only started is extracted again over the files it
+# already saved. With a guard, archives over its limits are quarantined (and
+# journaled, so a rollback puts them back).
+def apply_extract(directory, op_index, zip_path, journal, extracted_before, started_before, guard=None):
+    trash_dir = os.path.join(directory, TRASH_NAME)
+    pending = [(zip_path, 0)]
+    while pending:
+        path, depth = pending.pop()
+        if path in extracted_before:
+            extracted_files = extracted_before[path]['files']
+        else:
+            name = f"{op_index}_{len(extracted_before)}"
+
+            def prepare(targets):
+                if path not in started_before:
+                    started_before[path] = save_targets(trash_dir, f"{name}_overwritten", path, targets, journal)
+
+            try:
+                _, extracted_files = submission_unzip.extract_zip_file(path, guard, depth, prepare)
+            except LimitExceeded as e:
+                quarantine_path = guard.quarantine(path, e)
+                journal({'quarantined': path, 'to': quarantine_path})
+                print(f"Quarantined {os.path.basename(path)} - {e} (moved to {quarantine_path})")
+                continue
+            except (zipfile.BadZipFile, OSError) as e:
+                print(f"Failed to unzip {os.path.basename(path)} - {e}")
+                if path in started_before:
+                    restore_targets(started_before[path], remove_written=False)
+                continue
+            print(f"Unzipped {os.path.basename(path)} in {os.path.dirname(path)}")
+            trash_path = os.path.join(trash_dir, f"{name}_{os.path.basename(path)}")
+            os.replace(path, trash_path)
+            entry = {'extracted': path, 'trash': trash_path, 'files': extracted_files}
+            journal(entry)
+            extracted_before[path] = entry
+        pending.extend((p, depth + 1) for p in extracted_files if p.endswith('.zip') and p != path)
+
+
+def apply_op(directory, op_index, op, journal, extracted_before, started_before, guard=None):
+    kind = op['op']
+    if kind == 'extract':
+        apply_extract(directory, op_index, op['path'], journal, extracted_before, started_before, guard)
+    elif kind in ('rename', 'move'):
+        if os.path.lexists(op['dst']) and not os.path.lexists(op['src']):
+            return  # Done before an interruption, but not journaled
+        submission_merge.move_path(op['src'], op['dst'])
+    elif kind == 'rmdir':
+        if os.path.isdir(op['path']):
+            os.rmdir(op['path'])
+
+
+# Applies a phase's operations, skipping those the journal shows as done
+def apply_plan(directory, phase, ops, log_file, manifest=None, guard=None):
+    with open(plan_path(directory, phase), 'w', encoding='utf-8') as f:
+        json.dump(ops, f)
+    os.makedirs(os.path.join(directory, TRASH_NAME), exist_ok=True)
+    resume_plan(directory, phase, log_file, manifest, guard)
+
+
+def read_journal(directory, phase):
+    entries = []
+    path = journal_path(directory, phase)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # Torn last line from a crash
+    return entries
+
+
+def resume_plan(directory, phase, log_file, manifest=None, guard=None):
+    with open(plan_path(directory, phase), encoding='utf-8') as f:
+        ops = json.load(f)
+    entries = read_journal(directory, phase)
+    done = {entry['done'] for entry in entries if 'done' in entry}
+    extracted_before = {entry['extracted']: entry for entry in entries if 'extracted' in entry}
+    started_before = {entry['extracting']: entry for entry in entries if 'extracting' in entry}
+    os.makedirs(os.path.join(directory, TRASH_NAME), exist_ok=True)
+
+    with open(journal_path(directory, phase), 'a', encoding='utf-8') as journal_file:
+        def journal(entry):
+            journal_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        for i, op in enumerate(ops):
+            if i in done:
+                continue
+            apply_op(directory, i, op, journal, extracted_before, started_before, guard)
+            if op.get('message'):
+                print(op['message'])
+            if op.get('log'):
+                log_file.write(op['log'])
+            if op.get('record') and manifest is not None:
+                manifest.record_rename(*op['record'])
+            if op.get('merge_copy') and manifest is not None:
+                manifest.record_merge_copies([op['dst']])
+            journal({'done': i})
+    if manifest is not None:
+        manifest.save()
+
+
+# Applies both phases, resuming any phase an interrupted run left behind, then
+# commits. The rename phase is planned only once extraction is done, so it sees
+# the real extracted tree; plan_extract and plan_rename return the ops.
+def run_plan(directory, log_file, plan_extract, plan_rename, manifest=None, guard=None):
+    for phase, make_ops in (('extract', plan_extract), ('rename', plan_rename)):
+        if os.path.exists(plan_path(directory, phase)):
+            print(f"Resuming the unfinished {phase} phase")
+            resume_plan(directory, phase, log_file, manifest, guard)
+        else:
+            apply_plan(directory, phase, make_ops(), log_file, manifest, guard)
+    commit_run(directory)
+
+
+# Finishes a run: the trash, plans and journals are no longer needed
+def commit_run(directory):
+    shutil.rmtree(os.path.join(directory, TRASH_NAME), ignore_errors=True)
+    for phase in PHASES:
+        for path in (plan_path(directory, phase), journal_path(directory, phase)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Undoes every journaled operation of an unfinished run, newest first
+def rollback_run(directory, manifest=None):
+    for phase in reversed(PHASES):
+        if not os.path.exists(plan_path(directory, phase)):
+            continue
+        with open(plan_path(directory, phase), encoding='utf-8') as f:
+            ops = json.load(f)
+        for entry in reversed(read_journal(directory, phase)):
+            if 'extracted' in entry:
+                for path in entry['files']:
+                    if os.path.lexists(path):
+                        os.remove(path)
+                        remove_empty_parents(os.path.dirname(path), os.path.dirname(entry['extracted']))
+                os.replace(entry['trash'], entry['extracted'])
+                print(f"Restored {entry['extracted']}")
+            elif 'extracting' in entry:
+                restore_targets(entry)
+            elif 'quarantined' in entry:
+                if os.path.lexists(entry['to']):
+                    shutil.move(entry['to'], entry['quarantined'])
+                    print(f"Restored {entry['quarantined']} from quarantine")
+            elif 'done' in entry:
+                op = ops[entry['done']]
+                if op['op'] in ('rename', 'move') and os.path.lexists(op['dst']):
+                    os.rename(op['dst'], op['src'])
+                    print(f"Moved back {op['dst']} → {op['src']}")
+                elif op['op'] == 'rmdir':
+                    os.makedirs(op['path'], exist_ok=True)
+                if op.get('record') and manifest is not None:
+                    manifest.forget_rename(*op['record'])
+                if op.get('merge_copy') and manifest is not None:
+                    manifest.forget_merge_copy(op['dst'])
+    commit_run(directory)
+    if manifest is not None:
+        manifest.save()
+
+
+def remove_empty_parents(path, stop):
+    while path != stop and path.startswith(stop + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
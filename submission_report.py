@@ -0,0 +1,207 @@
+import csv
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+
+# Streaming submission report engine.
+#
+# Each top-level student folder is scanned with os.scandir, taking size and
+# mtime from a single stat per file, and the report is written directory by
+# directory as it is scanned rather than built up in memory.
+#
+# Formats:
+#   'text'  - the indented listing written by write_submission_report
+#   'jsonl' - one JSON object per file: folder, path, size, mtime, late
+#   'csv'   - the same fields as CSV with a header row
+# When a deadline is given, files modified after it are flagged as late.
+REPORT_FORMATS = ('text', 'jsonl', 'csv')
+REPORT_FIELDS = ('folder', 'path', 'size', 'mtime', 'late')
+
+
+# Timestamps repeat heavily (restored ZIP times), so each second is formatted once
+@lru_cache(maxsize=4096)
+def format_timestamp(seconds):
+    return datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Scans one student folder, yielding (level, dir names, files) per directory in
+# the same top-down order as os.walk; files are (name, rel_path, size, mtime).
+# Directory symlinks are listed but not followed, as with os.walk.
+def scan_folder(folder_path):
+    stack = [(folder_path, '', 1)]
+    while stack:
+        root, rel_root, level = stack.pop()
+        dirs = []
+        files = []
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        dirs.append(entry)
+                    else:
+                        st = entry.stat()
+                        files.append((entry.name, os.path.join(rel_root, entry.name), st.st_size, st.st_mtime))
+        except OSError:
+            continue
+        dirs.sort(key=lambda e: e.name)
+        files.sort()
+        yield level, [d.name for d in dirs], files
+        for d in reversed(dirs):
+            if not d.is_symlink():
+                stack.append((d.path, os.path.join(rel_root, d.name), level + 1))
+
+
+# Lists one folder as the (rel_path, is_dir, size, mtime) entries scan_listing
+# takes, so a folder can be scanned ahead of the report being written.
+# Directory symlinks are listed but not followed, as in scan_folder.
+def folder_listing(folder_path):
+    entries = []
+    stack = [(folder_path, '')]
+    while stack:
+        root, rel_root = stack.pop()
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    rel_path = os.path.join(rel_root, entry.name)
+                    if entry.is_dir():
+                        entries.append((rel_path, True, 0, 0))
+                        if not entry.is_symlink():
+                            stack.append((entry.path, rel_path))
+                    else:
+                        st = entry.stat()
+                        entries.append((rel_path, False, st.st_size, st.st_mtime))
+        except OSError:
+            continue
+    return entries
+
+
+# Turns a listing collected elsewhere (e.g. during extraction) into the same
+# (level, dir names, files) stream without touching the disk.
+# `entries` holds (rel_path, is_dir, size, mtime) tuples relative to the folder.
+def scan_listing(entries):
+    children = {'': ([], [])}
+    for rel_path, is_dir, size, mtime in entries:
+        parent, name = os.path.split(rel_path)
+        # Make sure every ancestor directory is known even if it had no entry of its own
+        ancestor = parent
+        missing = []
+        while ancestor not in children:
+            missing.append(ancestor)
+            ancestor = os.path.dirname(ancestor)
+        for path in reversed(missing):
+            children[path] = ([], [])
+            children[os.path.dirname(path)][0].append(os.path.basename(path))
+        if is_dir:
+            if rel_path not in children:
+                children[rel_path] = ([], [])
+                children[parent][0].append(name)
+        else:
+            children[parent][1].append((name, rel_path, size, mtime))
+
+    stack = [('', 1)]
+    while stack:
+        rel_root, level = stack.pop()
+        dirs, files = children[rel_root]
+        dirs = sorted(dirs)
+        yield level, dirs, sorted(files)
+        for d in reversed(dirs):
+            stack.append((os.path.join(rel_root, d), level + 1))
+
+
+# Passes a scan through, counting its files and bytes as it is consumed
+def counted_scan(scan, metrics):
+    for level, dirs, files in scan:
+        metrics.add('report', files=len(files), bytes=sum(file[2] for file in files))
+        yield level, dirs, files
+
+
+def is_late(mtime, deadline):
+    return deadline is not None and mtime > deadline.timestamp()
+
+
+# Yields the lines of the text report block for one folder
+def text_lines(folder, scan, deadline=None):
+    yield f"{folder}\n"
+    for level, dirs, files in scan:
+        indent = '  ' * level
+        for d in dirs:
+            yield f"{indent}{d}/\n"
+        for name, rel_path, size, mtime in files:
+            late = " [LATE]" if is_late(mtime, deadline) else ""
+            yield f"{indent}{name} ({format_timestamp(int(mtime))}){late}\n"
+    yield "\n"
+
+
+# Returns the text report block for one folder, as write_submission_report writes it
+def text_block(folder, scan, deadline=None):
+    return ''.join(text_lines(folder, scan, deadline))
+
+
+# Writes a report over the top-level folders of a directory to report_path.
+# `listings` optionally maps folder names to entries for scan_listing, which are
+# used instead of scanning those folders again. With a manifest, text blocks of
+# folders unchanged since the last run are reused (not when flagging late files,
+# since the deadline may have changed). With metrics (see submission_metrics),
+# folders, files and bytes reported are counted under the 'report' stage.
+# Re-downloaded copies of folders an earlier run renamed (see
+# SubmissionManifest.redownloaded_folders) are left out: they are not students.
+# With low_memory, text blocks are written line by line as the folder is
+# scanned and not cached, so no folder's listing is held in memory at once.
+def write_report(directory, report_path, fmt='text', deadline=None, listings=None, manifest=None, metrics=None,
+                 low_memory=False):
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format '{fmt}', expected one of {REPORT_FORMATS}")
+    listings = listings or {}
+    use_cache = manifest is not None and fmt == 'text' and deadline is None and not low_memory
+    skip = manifest.redownloaded_folders() if manifest is not None else {}
+    folders = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir() and entry.name not in skip:
+                folders.append((entry.name, entry.stat().st_mtime_ns))
+    folders.sort()
+
+    with open(report_path, 'w', encoding='utf-8', newline='' if fmt == 'csv' else None) as rpt:
+        writer = csv.writer(rpt) if fmt == 'csv' else None
+        if writer is not None:
+            writer.writerow(REPORT_FIELDS)
+        for folder, folder_mtime in folders:
+            if use_cache:
+                block = manifest.cached_report_block(folder, folder_mtime)
+                if block is not None:
+                    rpt.write(block)
+                    if metrics is not None:
+                        metrics.add('report', folders=1, cached=1)
+                    continue
+            if folder in listings:
+                scan = scan_listing(listings[folder])
+            else:
+                scan = scan_folder(os.path.join(directory, folder))
+            if metrics is not None:
+                scan = counted_scan(scan, metrics)
+                metrics.add('report', folders=1)
+
+            if fmt == 'text' and low_memory:
+                rpt.writelines(text_lines(folder, scan, deadline))
+                continue
+            if fmt == 'text':
+                block = text_block(folder, scan, deadline)
+                if use_cache:
+                    manifest.store_report_block(folder, block, folder_mtime)
+                rpt.write(block)
+                continue
+            for level, dirs, files in scan:
+                for name, rel_path, size, mtime in files:
+                    record = (folder, rel_path.replace(os.sep, '/'), size,
+                              datetime.fromtimestamp(mtime).isoformat(timespec='seconds'),
+                              is_late(mtime, deadline))
+                    if writer is not None:
+                        writer.writerow(record)
+                    else:
+                        rpt.write(json.dumps(dict(zip(REPORT_FIELDS, record)), ensure_ascii=False) + "\n")
+        if fmt == 'text':
+            rpt.write("End of Report\n")
+    if use_cache:
+        manifest.prune_reports({folder for folder, _ in folders})
+        manifest.save()
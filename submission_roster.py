@@ -0,0 +1,296 @@
+import csv
+import marshal
+import os
+import re
+import sys
+from difflib import SequenceMatcher
+
+from submission_backup import file_sha256
+
+# Indexed roster lookup for folder names that do not match the CSV exactly.
+#
+# A folder is resolved in order of confidence:
+#   1. a student ID found in the folder name (the first 8 characters, as the
+#      v2 script uses, or any 8-digit run)               -> confidence 1.0
+#   2. the exact normalised name                         -> confidence 1.0
+#   3. the same name tokens in a different order         -> confidence 0.95
+#   4. trigram candidates scored by edit similarity      -> confidence = ratio
+#      (the better of the sorted-token and spaceless comparisons)
+# Trigram postings keep each fuzzy lookup to the handful of roster entries
+# that share text with the folder name instead of scanning the whole roster.
+# Two different students' names can be this close (TAN WEI MING and TAN WEI
+# LING score 0.92), so a fuzzy match is only a suggestion unless the index is
+# given an auto_confidence it reaches (see RosterIndex.applies).
+#
+# Rosters themselves are loaded with load_roster into a Roster: one list per
+# column plus name and student ID indexes. The parsed columns are cached next
+# to the CSV (.<csv name>.cache); the cache is used while the CSV's mtime and
+# size are unchanged, or its SHA-256 still matches (e.g. after a copy), so a
+# repeat run does not parse a large faculty roster again.
+
+DEFAULT_MIN_CONFIDENCE = 0.85
+TOKEN_SORT_CONFIDENCE = 0.95
+STUDENT_ID_LENGTH = 8
+# Only the best trigram candidates are scored with SequenceMatcher
+MAX_FUZZY_CANDIDATES = 10
+
+ROSTER_CACHE_VERSION = 1
+
+STUDENT_ID_RE = re.compile(r'(?<!\d)\d{%d}(?!\d)' % STUDENT_ID_LENGTH)
+FOLDER_NAME_RE = re.compile(r'-\s*(.*?)\s*SOI', flags=re.IGNORECASE)
+
+
+# Uppercases, drops commas and collapses whitespace, like read_name_list does
+def normalise_name(name):
+    return ' '.join(name.strip().upper().replace(',', '').split())
+
+
+# Order-independent key: alphanumeric tokens only, sorted
+def token_sort_key(name):
+    return ' '.join(sorted(re.findall(r'[A-Z0-9]+', name.upper())))
+
+
+# Letters and digits only, in their original order
+def compact_name(name):
+    return ''.join(re.findall(r'[A-Z0-9]+', name.upper()))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Pulls the student name out of a folder name such as "<id> - <name> SOI..."
+def folder_name_part(folder_name):
+    m = FOLDER_NAME_RE.search(folder_name)
+    return normalise_name(m.group(1)) if m else ""
+
+
+# A roster held as columns. Row i is (student_ids[i], names[i], classes[i], teams[i]);
+# raw_names keeps each name as written in the CSV, names its normalised form.
+class Roster:
+    __slots__ = ('student_ids', 'raw_names', 'names', 'classes', 'teams', 'by_name', 'by_id')
+
+    def __init__(self, student_ids, raw_names, names, classes, teams):
+        self.student_ids = student_ids
+        self.raw_names = raw_names
+        self.names = names
+        # Classes and teams repeat on every row; interning keeps one copy of each
+        self.classes = [sys.intern(value) for value in classes]
+        self.teams = [sys.intern(value) for value in teams]
+        # Later rows win, as they did in the dictionaries the scripts used to build
+        self.by_name = dict(zip(names, range(len(names))))
+        self.by_id = dict(zip(student_ids, range(len(student_ids))))
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        columns = ([], [], [], [], [])
+        with open(csv_path, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                columns[0].append(row['student_id'])
+                columns[1].append(row['name'])
+                columns[2].append(normalise_name(row['name']))
+                columns[3].append(row['class'])
+                columns[4].append(row['team'])
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    # Returns (student_id, normalised name, class, team) for a row
+    def record(self, row):
+        return self.student_ids[row], self.names[row], self.classes[row], self.teams[row]
+
+    def lookup_name(self, name):
+        row = self.by_name.get(normalise_name(name))
+        return None if row is None else self.record(row)
+
+    def lookup_id(self, student_id):
+        row = self.by_id.get(student_id)
+        return None if row is None else self.record(row)
+
+    # {normalised name: [student_id, class, team]}, as read_name_list returns
+    def name_dict(self):
+        return {self.names[row]: [self.student_ids[row], self.classes[row], self.teams[row]]
+                for row in self.by_name.values()}
+
+    # {name as written: [student_id, class, team]}
+    def raw_name_dict(self):
+        return {name: [student_id, class_, team]
+                for student_id, name, class_, team in zip(self.student_ids, self.raw_names, self.classes, self.teams)}
+
+    # {student_id: [name as written, class, team]}
+    def id_dict(self):
+        return {self.student_ids[row]: [self.raw_names[row], self.classes[row], self.teams[row]]
+                for row in self.by_id.values()}
+
+    def columns(self):
+        return self.student_ids, self.raw_names, self.names, self.classes, self.teams
+
+
+def roster_cache_path(csv_path):
+    directory, filename = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(directory, f".{filename}.cache")
+
+
+# Loads a roster CSV, from its cache when the CSV is unchanged.
+# The cache is only an optimisation: if it cannot be read or written the CSV is parsed.
+def load_roster(csv_path, use_cache=True):
+    if not use_cache:
+        return Roster.from_csv(csv_path)
+    cache_path = roster_cache_path(csv_path)
+    st = os.stat(csv_path)
+    cached = None
+    try:
+        # One read and loads() is much faster than marshal.load() on the file object
+        with open(cache_path, 'rb') as f:
+            cached = marshal.loads(f.read())
+        if cached.get('version') != ROSTER_CACHE_VERSION:
+            cached = None
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        cached = None
+
+    if cached is not None and cached['mtime_ns'] == st.st_mtime_ns and cached['size'] == st.st_size:
+        return Roster(*cached['columns'])
+    sha256 = file_sha256(csv_path)
+    if cached is not None and cached['sha256'] == sha256:
+        roster = Roster(*cached['columns'])
+    else:
+        roster = Roster.from_csv(csv_path)
+    save_roster_cache(cache_path, roster, st, sha256)
+    return roster
+
+
+def save_roster_cache(cache_path, roster, st, sha256):
+    cache = {'version': ROSTER_CACHE_VERSION, 'mtime_ns': st.st_mtime_ns, 'size': st.st_size,
+             'sha256': sha256, 'columns': roster.columns()}
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(marshal.dumps(cache))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # e.g. a read-only roster folder
+
+
+class RosterMatch:
+    __slots__ = ('name', 'student_id', 'class_', 'team', 'confidence', 'method')
+
+    def __init__(self, name, student_id, class_, team, confidence, method):
+        self.name = name
+        self.student_id = student_id
+        self.class_ = class_
+        self.team = team
+        self.confidence = confidence
+        self.method = method
+
+    def __repr__(self):
+        return (f"RosterMatch({self.name!r}, {self.student_id!r}, {self.team!r}, "
+                f"confidence={self.confidence:.2f}, method={self.method!r})")
+
+
+class RosterIndex:
+    def __init__(self, min_confidence=DEFAULT_MIN_CONFIDENCE, auto_confidence=None):
+        self.min_confidence = min_confidence
+        self.auto_confidence = auto_confidence
+        self.records = []          # (name, student_id, class, team)
+        self.by_name = {}
+        self.by_id = {}
+        self.by_token_key = {}
+        self.token_keys = []
+        self.compact_names = []
+        self.postings = {}         # trigram -> list of record indexes
+
+    # Builds an index over every row of a Roster, so students who share a
+    # normalised name can each still be matched by ID
+    @classmethod
+    def from_roster(cls, roster, min_confidence=DEFAULT_MIN_CONFIDENCE, auto_confidence=None):
+        index = cls(min_confidence, auto_confidence)
+        for row in range(len(roster)):
+            student_id, name, class_, team = roster.record(row)
+            index.add(name, student_id, class_, team)
+        return index
+
+    # Builds an index from the {normalised name: [student_id, class, team]}
+    # dictionary returned by read_name_list
+    @classmethod
+    def from_name_dict(cls, name_dict, min_confidence=DEFAULT_MIN_CONFIDENCE, auto_confidence=None):
+        index = cls(min_confidence, auto_confidence)
+        for name, (student_id, class_, team) in name_dict.items():
+            index.add(name, student_id, class_, team)
+        return index
+
+    # Builds one index over several {normalised name: [student_id, class, team]}
+    # dictionaries. Every student can be matched by ID; where the same name is
+    # in more than one dictionary, an exact name match gives the first one's student.
+    @classmethod
+    def from_name_dicts(cls, name_dicts, min_confidence=DEFAULT_MIN_CONFIDENCE, auto_confidence=None):
+        index = cls(min_confidence, auto_confidence)
+        for name_dict in name_dicts:
+            for name, (student_id, class_, team) in name_dict.items():
+                index.add(name, student_id, class_, team)
+        return index
+
+    # The first student added under a name or ID keeps it
+    def add(self, name, student_id, class_, team):
+        name = normalise_name(name)
+        idx = len(self.records)
+        self.records.append((name, student_id, class_, team))
+        self.by_name.setdefault(name, idx)
+        self.by_id.setdefault(student_id, idx)
+        key = token_sort_key(name)
+        self.by_token_key.setdefault(key, idx)
+        self.token_keys.append(key)
+        self.compact_names.append(compact_name(name))
+        for gram in trigrams(key):
+            self.postings.setdefault(gram, []).append(idx)
+
+    def _match(self, idx, confidence, method):
+        name, student_id, class_, team = self.records[idx]
+        return RosterMatch(name, student_id, class_, team, confidence, method)
+
+    # Returns the best RosterMatch for a folder name, or None if nothing
+    # reaches min_confidence
+    def match_folder(self, folder_name):
+        prefix = folder_name[:STUDENT_ID_LENGTH]
+        if prefix in self.by_id:
+            return self._match(self.by_id[prefix], 1.0, 'student_id')
+        for student_id in STUDENT_ID_RE.findall(folder_name):
+            if student_id in self.by_id:
+                return self._match(self.by_id[student_id], 1.0, 'student_id')
+        return self.match_name(folder_name_part(folder_name))
+
+    # True if a match may be applied without review: student ID, exact and
+    # token-sort matches always; fuzzy ones only at or above auto_confidence
+    def applies(self, match):
+        if match.method != 'fuzzy':
+            return True
+        return self.auto_confidence is not None and match.confidence >= self.auto_confidence
+
+    def match_name(self, name):
+        name = normalise_name(name)
+        if not name:
+            return None
+        if name in self.by_name:
+            return self._match(self.by_name[name], 1.0, 'exact')
+        key = token_sort_key(name)
+        if key in self.by_token_key:
+            return self._match(self.by_token_key[key], TOKEN_SORT_CONFIDENCE, 'token_sort')
+
+        # Count shared trigrams, then score only the strongest candidates
+        hits = {}
+        for gram in trigrams(key):
+            for idx in self.postings.get(gram, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+        candidates = sorted(hits, key=hits.get, reverse=True)[:MAX_FUZZY_CANDIDATES]
+        compact = compact_name(name)
+        best_idx, best_ratio = None, 0.0
+        for idx in candidates:
+            # Sorted tokens catch reordered names, the compact form catches split or joined ones
+            ratio = max(SequenceMatcher(None, key, self.token_keys[idx]).ratio(),
+                        SequenceMatcher(None, compact, self.compact_names[idx]).ratio())
+            if ratio > best_ratio:
+                best_idx, best_ratio = idx, ratio
+        if best_idx is None or best_ratio < self.min_confidence:
+            return None
+        return self._match(best_idx, best_ratio, 'fuzzy')
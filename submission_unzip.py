@@ -0,0 +1,255 @@
+import os
+import shutil
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from submission_guard import ExtractionGuard, LimitExceeded
+
+# Shared ZIP extraction engine used by the rename scripts.
+# Archives are kept on a worklist: the tree is walked once to seed it, and
+# every .zip written out during extraction is pushed straight back onto it,
+# so nested archives never trigger another full walk of the submission tree.
+
+
+# Finds every ZIP file under a directory with a single walk of the tree
+def find_zip_files(directory):
+    zip_paths = []
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith('.zip'):
+                zip_paths.append(os.path.join(root, filename))
+    return zip_paths
+
+
+# Members are streamed to disk in chunks of this size
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+# Maps an archive member name to a path under dest_dir, dropping drive letters,
+# absolute prefixes and '..' components the same way ZipFile.extract does
+def member_target_path(member_name, dest_dir):
+    arcname = member_name.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_parts)
+    if os.path.sep == '\\':
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+    return os.path.join(dest_dir, arcname)
+
+
+# Works out each distinct member timestamp once; most members of a
+# submission share a handful of them
+def member_mtimes(members):
+    mtime_cache = {}
+    for zip_info in members:
+        if zip_info.date_time not in mtime_cache:
+            mtime_cache[zip_info.date_time] = time.mktime(zip_info.date_time + (0, 0, -1))
+    return mtime_cache
+
+
+# Members are written under this suffix and then renamed over their target
+PART_SUFFIX = '.extracting'
+
+
+# Streams one file member of an open archive to target_path.
+# The member is written to a new file that then replaces target_path, never
+# through an existing one: a file already there may be hardlinked (a backup
+# made with the 'hardlink' strategy, or a deduplicated file), and writing
+# into it would change every other name of that file too.
+def write_member(zip_ref, zip_info, target_path, created_dirs):
+    parent_dir = os.path.dirname(target_path)
+    if parent_dir not in created_dirs:
+        os.makedirs(parent_dir, exist_ok=True)
+        created_dirs.add(parent_dir)
+    part_path = target_path + PART_SUFFIX
+    try:
+        with zip_ref.open(zip_info) as src, open(part_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        os.replace(part_path, target_path)
+    except BaseException:
+        if os.path.lexists(part_path):
+            os.remove(part_path)
+        raise
+
+
+# Applies the collected (path, mtime) pairs once everything is written.
+# Directories go last and deepest first, since writing into a directory
+# (or restoring a child directory) updates its mtime again.
+def restore_timestamps(file_times, dir_times):
+    for path, mtime in file_times:
+        os.utime(path, (mtime, mtime))
+    dir_times.sort(key=lambda item: item[0].count(os.path.sep), reverse=True)
+    for path, mtime in dir_times:
+        os.utime(path, (mtime, mtime))
+
+
+# Extracts one archive next to itself, restoring the original timestamps.
+# Members are streamed straight from the archive; their mtimes are worked out
+# once up front and applied in a single pass after everything is written.
+# prepare, if given, is called with the target path of every file member once
+# the guard has passed the archive and before anything is written.
+# With low_memory nothing is kept per member: each file gets its timestamp back
+# as soon as it is written (writing other files does not change it) and only
+# nested archives are remembered, so memory does not grow with the number of
+# members beyond what zipfile itself holds.
+# Returns (files extracted, their paths - only the nested ZIPs with low_memory).
+def extract_zip_file(zip_path, guard=None, depth=0, prepare=None, low_memory=False):
+    root = os.path.dirname(zip_path)
+    files = 0
+    extracted_files = []
+    file_times = []
+    dir_times = []
+    created_dirs = set()
+    if guard is not None:
+        guard.precheck(zip_path, depth)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = zip_ref.infolist()
+        if guard is not None:
+            guard.check(zip_path, members, depth)
+        if prepare is not None:
+            prepare([member_target_path(info.filename, root) for info in members if not info.is_dir()])
+        mtime_cache = member_mtimes(members)
+
+        for zip_info in members:
+            target_path = member_target_path(zip_info.filename, root)
+            mtime = mtime_cache[zip_info.date_time]
+            if zip_info.is_dir():
+                if target_path != root:
+                    os.makedirs(target_path, exist_ok=True)
+                    created_dirs.add(target_path)
+                    dir_times.append((target_path, mtime))
+                continue
+
+            write_member(zip_ref, zip_info, target_path, created_dirs)
+            files += 1
+            if not low_memory:
+                file_times.append((target_path, mtime))
+                extracted_files.append(target_path)
+                continue
+            os.utime(target_path, (mtime, mtime))
+            if target_path.endswith('.zip'):
+                extracted_files.append(target_path)
+
+    restore_timestamps(file_times, dir_times)
+    return files, extracted_files
+
+
+# Unzips every archive on the worklist, pushing nested ZIPs as they are written.
+# Each ZIP is removed after a successful extraction; corrupted ones are left in place.
+# Messages go through `log`; failures are returned as a list of (zip_path, reason).
+# on_archive, if given, is called as on_archive(zip_path, seconds, size, files)
+# for every archive extracted. With a guard (see submission_guard), archives
+# over its limits are quarantined instead of extracted. low_memory is passed
+# on to extract_zip_file.
+def unzip_worklist(zip_paths, log=print, on_archive=None, guard=None, low_memory=False):
+    errors = []
+    pending = deque((zip_path, 0) for zip_path in zip_paths)
+    queued = set(zip_paths)
+    while pending:
+        zip_path, depth = pending.popleft()
+        queued.discard(zip_path)
+        root, filename = os.path.split(zip_path)
+        try:
+            start = time.perf_counter()
+            size = os.path.getsize(zip_path)
+            files, extracted_files = extract_zip_file(zip_path, guard, depth, low_memory=low_memory)
+        except LimitExceeded as e:
+            quarantine_path = guard.quarantine(zip_path, e)
+            log(f"Quarantined {filename} - {e} (moved to {quarantine_path})")
+            errors.append((zip_path, f"quarantined: {e}"))
+            continue
+        except zipfile.BadZipFile:
+            log(f"Failed to unzip {filename} - not a zip file or corrupted.")
+            errors.append((zip_path, "not a zip file or corrupted"))
+            continue
+        except OSError as e:
+            log(f"Failed to unzip {filename} - {e}")
+            errors.append((zip_path, str(e)))
+            continue
+        log(f"Unzipped {filename} in {root}")
+        os.remove(zip_path)  # Remove ZIP after extraction
+        if on_archive is not None:
+            on_archive(zip_path, time.perf_counter() - start, size, files)
+        for extracted_path in extracted_files:
+            # The same nested ZIP may be written by two archives; queue it once
+            if extracted_path.endswith('.zip') and extracted_path != zip_path and extracted_path not in queued:
+                pending.append((extracted_path, depth + 1))
+                queued.add(extracted_path)
+    return errors
+
+
+# Unzips the ZIPs of one top-level student folder.
+# Runs inside a pool worker, so messages and archive timings are buffered and
+# handed back with the errors.
+def unzip_student_folder(zip_paths, guard=None, low_memory=False):
+    messages = []
+    timings = []
+    errors = unzip_worklist(zip_paths, messages.append, lambda *timing: timings.append(timing), guard, low_memory)
+    return messages, errors, timings
+
+
+# Groups ZIP paths by the top-level folder of `directory` they live in.
+# ZIPs lying directly in `directory` are returned separately.
+def shard_by_student_folder(directory, zip_paths):
+    top_zips = []
+    shards = {}
+    for zip_path in zip_paths:
+        rel_path = os.path.relpath(zip_path, directory)
+        if os.sep not in rel_path:
+            top_zips.append(zip_path)
+        else:
+            folder = os.path.join(directory, rel_path.split(os.sep, 1)[0])
+            shards.setdefault(folder, []).append(zip_path)
+    return top_zips, shards
+
+
+# Unzips the given ZIPs with the student folders spread over a bounded pool of
+# `workers`. ZIPs lying directly in the directory are handled first on the
+# calling thread since they may extract into any folder. Messages are printed
+# in folder order once each shard finishes, so the output matches the serial
+# run regardless of scheduling.
+def unzip_zip_files_parallel(directory, zip_paths, workers, use_processes=False, log=print, on_archive=None,
+                             guard=None, low_memory=False):
+    top_zips, shards = shard_by_student_folder(directory, zip_paths)
+    errors = unzip_worklist(top_zips, log, on_archive, guard, low_memory)
+
+    folders = sorted(shards)
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        futures = [executor.submit(unzip_student_folder, shards[folder], guard, low_memory) for folder in folders]
+        for folder, future in zip(folders, futures):
+            try:
+                messages, folder_errors, timings = future.result()
+            except Exception as e:
+                log(f"Failed to unzip files in {folder} - {e}")
+                errors.append((folder, str(e)))
+                continue
+            for message in messages:
+                log(message)
+            if on_archive is not None:
+                for timing in timings:
+                    on_archive(*timing)
+            errors.extend(folder_errors)
+    return errors
+
+
+# Unzips the given ZIPs (and any nested ZIPs they contain) found under `directory`
+def unzip_zip_files(directory, zip_paths, workers=1, use_processes=False, log=print, on_archive=None,
+                    guard=None, low_memory=False):
+    if workers > 1:
+        return unzip_zip_files_parallel(directory, zip_paths, workers, use_processes, log, on_archive, guard,
+                                        low_memory)
+    return unzip_worklist(zip_paths, log, on_archive, guard, low_memory)
+
+
+# Recursively unzips all ZIP files (including nested ZIPs) under a directory.
+# With workers > 1 the student folders are extracted in parallel. Archives over
+# the limits of `guard` (by default submission_guard's) are quarantined.
+def unzip_all_zip_files(directory, workers=1, use_processes=False, guard=None):
+    if guard is None:
+        guard = ExtractionGuard(directory)
+    return unzip_zip_files(directory, find_zip_files(directory), workers, use_processes, guard=guard)
@@ -0,0 +1,51 @@
+import os
+import random
+import shutil
+
+import pytest
+
+import bench_pipeline
+import submission_memory
+
+# The low-memory mode keeps peak memory flat as the cohort grows; the normal
+# mode keeps per-folder listings and cached report blocks and grows with it.
+# Each run is measured in a fresh process (see bench_pipeline.measure_peak_rss).
+
+STUDENTS = 100
+SCALE = 4
+BUDGET_MB = 512
+# From 100 to 400 students the low-memory peak grows about 2 MB (the manifest,
+# which has an entry per archive) and the normal one about 8 MB
+MAX_LOW_MEMORY_GROWTH_MB = 3
+ROSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class001.csv')
+
+
+def cohort_peaks(tmp_path, students):
+    run_dir = os.path.join(tmp_path, f"cohort{students}")
+    cohort_dir = os.path.join(run_dir, 'cohort')
+    roster_path = os.path.join(run_dir, 'roster.csv')
+    roster_rows = bench_pipeline.build_roster([ROSTER], students, random.Random(0))
+    bench_pipeline.generate_cohort(cohort_dir, roster_path, roster_rows)
+    peaks = {}
+    for mode, budget_mb in (('low', BUDGET_MB), ('normal', None)):
+        target_directory = os.path.join(run_dir, mode, 'submissions')
+        shutil.copytree(cohort_dir, target_directory)
+        peak, over_budget = bench_pipeline.measure_peak_rss_isolated(target_directory, roster_path, budget_mb,
+                                                                     streaming=True)
+        if peak is None:
+            pytest.skip("peak memory cannot be measured on this platform")
+        assert not over_budget
+        peaks[mode] = peak / submission_memory.MB
+    shutil.rmtree(run_dir)
+    return peaks
+
+
+def test_low_memory_peak_stays_flat(tmp_path):
+    small = cohort_peaks(tmp_path, STUDENTS)
+    large = cohort_peaks(tmp_path, STUDENTS * SCALE)
+    low_growth = large['low'] - small['low']
+    normal_growth = large['normal'] - small['normal']
+    # Otherwise the cohorts are too small for the check to mean anything
+    assert normal_growth > 2 * MAX_LOW_MEMORY_GROWTH_MB, f"normal mode only grew {normal_growth:.1f} MB"
+    assert low_growth <= MAX_LOW_MEMORY_GROWTH_MB, \
+        f"low-memory peak grew {low_growth:.1f} MB (normal mode {normal_growth:.1f} MB)"